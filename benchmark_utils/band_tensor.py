@@ -0,0 +1,247 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import weakref
+    import numpy as np
+    import pandas as pd
+
+
+# Arrays returned by `unpack`, by id, as a weak reference and the packed
+# array they were unpacked from. Their memory is freed with them, so caches
+# keyed on memory addresses must key them on the packed array instead.
+_UNPACKED = {}
+
+
+def _packed_n_channels(n_packed):
+    n_channels = int(np.sqrt(8 * n_packed + 1) - 1) // 2
+    if n_channels * (n_channels + 1) // 2 != n_packed:
+        raise ValueError(f"{n_packed} is not the size of a packed upper "
+                         "triangle.")
+    return n_channels
+
+
+def pack(C):
+    # Upper triangles, row by row, of a stack of symmetric matrices:
+    # (..., n, n) -> (..., n * (n + 1) / 2).
+    rows, cols = np.triu_indices(C.shape[-1])
+    return C[..., rows, cols]
+
+
+def _unpack(P):
+    n_channels = _packed_n_channels(P.shape[-1])
+    rows, cols = np.triu_indices(n_channels)
+    C = np.empty(P.shape[:-1] + (n_channels, n_channels), dtype=P.dtype)
+    C[..., rows, cols] = P
+    C[..., cols, rows] = P
+    return C
+
+
+def unpack(P):
+    # Inverse of `pack`.
+    C = _unpack(P)
+    key = id(C)
+    _UNPACKED[key] = (
+        weakref.ref(C, lambda _: _UNPACKED.pop(key, None)), P
+    )
+    return C
+
+
+def unpacked_from(X):
+    # (C, P) if X is, or is a view on, an array C returned by `unpack(P)`.
+    while isinstance(X, np.ndarray):
+        ref, P = _UNPACKED.get(id(X), (None, None))
+        if ref is not None and ref() is X:
+            return X, P
+        X = X.base
+    return None
+
+
+class PackedCovariance:
+    # A covariance stored as its packed upper triangle, and only unpacked
+    # when converted to an array, e.g. when coffeine stacks the cells of a
+    # column.
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    @property
+    def shape(self):
+        n_channels = _packed_n_channels(len(self.packed))
+        return (n_channels, n_channels)
+
+    def __array__(self, dtype=None):
+        return np.asarray(_unpack(self.packed), dtype=dtype)
+
+
+class BandTensor:
+    """Covariances of several frequency bands stored in one array.
+
+    ``data`` has shape (n_subjects, n_bands, n_channels, n_channels) and
+    ``bands`` names its second axis. Selecting a band or a contiguous range
+    of subjects returns views on ``data``.
+
+    ``data`` can also hold the packed upper triangles of the covariances,
+    with shape (n_subjects, n_bands, n_channels * (n_channels + 1) / 2).
+    Selecting a band then unpacks the selected subjects, so slice the
+    subjects before the band to only unpack a batch of them.
+    """
+
+    def __init__(self, data, bands):
+        bands = list(bands)
+        if data.ndim not in (3, 4) or data.shape[1] != len(bands):
+            raise ValueError(
+                f"Expected data of shape (n_subjects, {len(bands)}, "
+                f"n_channels, n_channels) or (n_subjects, {len(bands)}, "
+                f"n_packed), got {data.shape}."
+            )
+        if data.ndim == 3:
+            _packed_n_channels(data.shape[-1])
+        self.data = data
+        self.bands = bands
+
+    @classmethod
+    def from_shared(cls, X, bands):
+        # Use the same (n_subjects, n_channels, n_channels) covariances, or
+        # packed (n_subjects, n_packed) ones, for every band without
+        # duplicating them in memory.
+        bands = list(bands)
+        data = np.broadcast_to(X[:, None], (len(X), len(bands)) + X.shape[1:])
+        return cls(data, bands)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def packed(self):
+        return self.data.ndim == 3
+
+    @property
+    def n_channels(self):
+        if self.packed:
+            return _packed_n_channels(self.data.shape[-1])
+        return self.data.shape[-1]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            stored = self.stored(key)
+            return unpack(stored) if self.packed else stored
+        return type(self)(_take_rows(self.data, key), self.bands)
+
+    def __reduce__(self):
+        if _is_shared(self.data):
+            return type(self).from_shared, (self.data[:, 0], self.bands)
+        return type(self), (self.data, self.bands)
+
+    def stored(self, band):
+        # View on the covariances of a band as stored, packed or not.
+        return self.data[:, self.bands.index(band)]
+
+    def diagonal(self, band):
+        # (n_subjects, n_channels) variances of a band, read without
+        # unpacking.
+        stored = self.stored(band)
+        if not self.packed:
+            return np.diagonal(stored, axis1=1, axis2=2)
+        rows, cols = np.triu_indices(self.n_channels)
+        return stored[:, np.flatnonzero(rows == cols)]
+
+    def diagonals(self):
+        # The variances of all bands, in memory.
+        if _is_shared(self.data):
+            return BandDiagonals.from_shared(
+                np.ascontiguousarray(self.diagonal(self.bands[0])), self.bands
+            )
+        return BandDiagonals(np.stack([self.diagonal(band)
+                                       for band in self.bands], axis=1),
+                             self.bands)
+
+    def mean(self, band):
+        # Float64 mean covariance of a band, computed on the stored form.
+        mean = self.stored(band).mean(axis=0, dtype=np.float64)
+        return unpack(mean) if self.packed else mean
+
+    def pack(self):
+        if self.packed:
+            return self
+        if _is_shared(self.data):
+            return BandTensor.from_shared(pack(self.data[:, 0]), self.bands)
+        return BandTensor(pack(self.data), self.bands)
+
+    def to_frame(self, bands=None):
+        # One column per band whose cells are views on `data`, which is the
+        # layout coffeine's filter bank transformers expect. Packed cells
+        # are PackedCovariances: each column is only unpacked when a
+        # transformer stacks it, one band at a time.
+        bands = self.bands if bands is None else bands
+        if not self.packed:
+            return pd.DataFrame({band: list(self.stored(band))
+                                 for band in bands})
+        columns = {}
+        for band in bands:
+            # Filled one by one, as numpy would convert a list of them.
+            cells = columns[band] = np.empty(len(self), dtype=object)
+            for i, packed in enumerate(self.stored(band)):
+                cells[i] = PackedCovariance(packed)
+        return pd.DataFrame(columns)
+
+
+class BandDiagonals(BandTensor):
+    """Variances of several frequency bands stored in one array.
+
+    ``data`` has shape (n_subjects, n_bands, n_channels) and holds the
+    diagonals of the covariances, which is all the diag features need, in a
+    memory linear in the number of channels. Selecting a band returns its
+    variances.
+    """
+
+    packed = False
+
+    def __init__(self, data, bands):
+        bands = list(bands)
+        if data.ndim != 3 or data.shape[1] != len(bands):
+            raise ValueError(
+                f"Expected data of shape (n_subjects, {len(bands)}, "
+                f"n_channels), got {data.shape}."
+            )
+        self.data = data
+        self.bands = bands
+
+    @property
+    def n_channels(self):
+        return self.data.shape[-1]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.stored(key)
+        return super().__getitem__(key)
+
+    def diagonal(self, band):
+        return self.stored(band)
+
+    def diagonals(self):
+        return self
+
+    def _no_covariances(self, *args, **kwargs):
+        raise ValueError("BandDiagonals do not hold the covariances.")
+
+    mean = pack = to_frame = _no_covariances
+
+
+def _is_shared(data):
+    return data.shape[1] > 1 and data.strides[1] == 0
+
+
+def _take_rows(data, key):
+    if isinstance(key, slice) or not _is_shared(data):
+        return data[key]
+    # Fancy indexing would materialize the broadcast band axis.
+    rows = data[:, 0][key]
+    return np.broadcast_to(rows[:, None], (len(rows),) + data.shape[1:])
@@ -0,0 +1,40 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import ast
+    from functools import lru_cache
+    from benchopt.benchmark import Benchmark
+
+
+# Helpers of the command line tools of benchmark_utils, which run the
+# benchmark's objective, datasets and solvers outside of `benchopt run`.
+
+
+def get_instance(klass, **parameters):
+    # First value of each parameter, as benchopt runs by default.
+    parameters = dict({name: values[0]
+                       for name, values in klass.parameters.items()},
+                      **parameters)
+    return klass.get_instance(**parameters)
+
+
+@lru_cache()
+def load_benchmark(benchmark_dir):
+    # The objective class, and the dataset and solver classes by name.
+    benchmark = Benchmark(benchmark_dir)
+    return (benchmark.get_benchmark_objective(),
+            {d.name: d for d in benchmark.get_datasets()},
+            {s.name: s for s in benchmark.get_solvers()})
+
+
+def parse_params(pairs):
+    # Parameters given as name=value on the command line, with the values
+    # parsed as Python literals when they are ones.
+    params = {}
+    for pair in pairs:
+        name, value = pair.split('=', 1)
+        try:
+            params[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[name] = value
+    return params
@@ -5,9 +5,11 @@ from benchopt import safe_import_context
 # the usual import syntax
 with safe_import_context() as import_ctx:
     import numpy as np
+    from fractions import Fraction
     from sklearn.base import BaseEstimator, TransformerMixin
     import mne
     import coffeine
+    from benchmark_utils.band_tensor import BandTensor
 
 
 class IdentityTransformer(BaseEstimator, TransformerMixin):
@@ -18,9 +20,40 @@ class IdentityTransformer(BaseEstimator, TransformerMixin):
         return self
 
     def transform(self, X, y=None):
+        if isinstance(X, BandTensor):
+            return X.to_frame(self.frequency_bands)
         return X[self.frequency_bands]
 
 
+class FilterBankDiag(BaseEstimator, TransformerMixin):
+    # Same features as coffeine's filter bank transformer with the `diag`
+    # method, the variances of each band concatenated band after band, read
+    # from the diagonals of a BandTensor, packed or not, without building a
+    # frame of full matrices.
+    def __init__(self, frequency_bands):
+        self.frequency_bands = frequency_bands
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        return np.concatenate([X.diagonal(band)
+                               for band in self.frequency_bands], axis=1)
+
+
+class AsType(BaseEstimator, TransformerMixin):
+    # Cast features, e.g. the float64 output of coffeine's transformers,
+    # to the precision of the rest of the pipeline.
+    def __init__(self, dtype='float64'):
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        return np.asarray(X, dtype=self.dtype)
+
+
 def preprocessing(raw, notch_freq, l_freq, h_freq, sfreq):
     raw_notch = raw.copy().load_data().notch_filter(notch_freq)
     raw_filter = raw_notch.copy().filter(l_freq, h_freq)
@@ -28,7 +61,55 @@ def preprocessing(raw, notch_freq, l_freq, h_freq, sfreq):
     return raw_resample
 
 
-def get_X(bids_root, datatype, task, subject_id, frequency_bands, extension):
+def _preprocess_window(raw, notch_freq, l_freq, h_freq, sfreq, tmin, tmax,
+                       pad):
+    # Only load [tmin - pad, tmax + pad] and process it in place. The margins
+    # absorb the edge effects of filtering and resampling before being
+    # cropped out. The loaded window spans a multiple of `step` samples so
+    # that it resamples to an integer number of samples, and resampling
+    # without extra padding keeps the output aligned on the input samples.
+    raw_sfreq = raw.info['sfreq']
+    step = Fraction(sfreq / raw_sfreq).limit_denominator(1000).denominator
+    start = int(max(tmin - pad, 0.) * raw_sfreq) // step * step
+    n_samples = (min(int(np.ceil((tmax + pad) * raw_sfreq)) + 1,
+                     len(raw.times)) - start) // step * step
+    raw_window = raw.copy().crop(start / raw_sfreq,
+                                 (start + n_samples - 1) / raw_sfreq,
+                                 include_tmax=True).load_data()
+    raw_window.notch_filter(notch_freq)
+    raw_window.filter(l_freq, h_freq)
+    raw_window.resample(sfreq, npad=0)
+    offset = start / raw_sfreq
+    return raw_window.crop(tmin - offset,
+                           min(tmax - offset, raw_window.times[-1]))
+
+
+def preprocessing_window(raw, notch_freq, l_freq, h_freq, sfreq, tmin=0.,
+                         tmax=None, pad=10., chunk_duration=None):
+    # Same as `preprocessing` on `raw.crop(tmin, tmax)`, but cropping before
+    # loading the data so that the memory depends on the analysed window and
+    # not on the file length. With `chunk_duration`, the window is processed
+    # in chunks and only the resampled data of the whole window is kept.
+    tmax = raw.times[-1] if tmax is None else min(tmax, raw.times[-1])
+    if chunk_duration is None:
+        return _preprocess_window(raw, notch_freq, l_freq, h_freq, sfreq,
+                                  tmin, tmax, pad)
+
+    data = []
+    for t_start in np.arange(tmin, tmax, chunk_duration):
+        t_stop = min(t_start + chunk_duration, tmax)
+        raw_chunk = _preprocess_window(raw, notch_freq, l_freq, h_freq,
+                                       sfreq, t_start, t_stop, pad)
+        # Chunks share their boundary sample, keep it only once.
+        stop = None if t_stop == tmax else -1
+        data.append(raw_chunk.get_data()[:, :stop])
+        info = raw_chunk.info
+    return mne.io.RawArray(np.concatenate(data, axis=1), info, verbose=False)
+
+
+def read_preprocessed(bids_root, datatype, task, subject_id, extension,
+                      notch_freq=60, l_freq=1, h_freq=49, sfreq=200,
+                      tmax=100, crop_first=True, chunk_duration=None):
     # Read raw and preprocess
     fname = (bids_root / subject_id / datatype /
              f'{subject_id}_task-{task}_{datatype}{extension}')
@@ -39,28 +120,75 @@ def get_X(bids_root, datatype, task, subject_id, frequency_bands, extension):
     pick = [ch for ch in eeg_channels if ch in montage_channels]
     raw.pick(pick)
     raw.set_montage(montage)
-    raw_preprocess = preprocessing(raw, notch_freq=60, l_freq=1,
-                                   h_freq=49, sfreq=200)
+    if crop_first:
+        return preprocessing_window(
+            raw, notch_freq=notch_freq, l_freq=l_freq, h_freq=h_freq,
+            sfreq=sfreq, tmax=tmax, chunk_duration=chunk_duration
+        )
+    return preprocessing(
+        raw, notch_freq=notch_freq, l_freq=l_freq, h_freq=h_freq,
+        sfreq=sfreq
+    ).crop(tmax=tmax)
+
+
+def get_X(bids_root, datatype, task, subject_id, frequency_bands, extension,
+          notch_freq=60, l_freq=1, h_freq=49, sfreq=200, tmax=100,
+          n_fft=1024, n_overlap=512, crop_first=True, chunk_duration=None):
+    raw_preprocess = read_preprocessed(
+        bids_root, datatype, task, subject_id, extension,
+        notch_freq=notch_freq, l_freq=l_freq, h_freq=h_freq, sfreq=sfreq,
+        tmax=tmax, crop_first=crop_first, chunk_duration=chunk_duration
+    )
     # Compute cov
-    cov, _ = coffeine.compute_features(raw_preprocess.crop(tmax=100),
+    cov, _ = coffeine.compute_features(raw_preprocess,
                                        features=('covs',),
-                                       n_fft=1024, n_overlap=512,
-                                       fs=raw.info['sfreq'], fmax=49,
+                                       n_fft=n_fft, n_overlap=n_overlap,
+                                       fs=raw_preprocess.info['sfreq'],
+                                       fmax=h_freq,
                                        frequency_bands=frequency_bands)
-    return cov['covs']
+    # coffeine computes an alpha band first, then the requested ones.
+    computed = list(dict({'alpha': None}, **frequency_bands))
+    return cov['covs'][[computed.index(band) for band in frequency_bands]]
 
 
-def _generate_X_y(n_sources, A_list, powers, beta, sigma_n, sigma_y, rng):
-    n_matrices = len(A_list)
-    n_dim = A_list[0].shape[0]
+def _generate_X_y(n_sources, A_list, powers, beta, sigma_n, sigma_y, rng,
+                  chunk_size=1000, dtype=np.float64, out=None,
+                  diagonal=False):
+    # `A_list` is either one mixing matrix shared by all subjects, of shape
+    # (n_dim, n_dim), or a stack of per-subject mixing matrices of shape
+    # (n_matrices, n_dim, n_dim). Covariances are built by batches of
+    # `chunk_size` subjects so that temporaries stay bounded, and written to
+    # `out` (e.g. a np.memmap) when it is given. With `diagonal`, only their
+    # (n_matrices, n_dim) diagonals are computed, for the same draws.
+    A = np.asarray(A_list)
+    n_matrices = len(powers)
+    n_dim = A.shape[-1]
+    if out is None:
+        shape = (n_matrices, n_dim) if diagonal else (n_matrices, n_dim, n_dim)
+        out = np.empty(shape, dtype=dtype)
+    X = out
 
-    # Generate covariances
-    Cs = np.zeros((n_matrices, n_dim, n_dim))
-    for i in range(n_matrices):
-        Cs[i, :n_sources, :n_sources] = np.diag(powers[i])  # set diag sources
-        N_i = sigma_n * rng.randn(n_dim - n_sources, n_dim - n_sources)
-        Cs[i, n_sources:, n_sources:] = N_i.dot(N_i.T)  # fill the noise block
-    X = np.array([a.dot(cs).dot(a.T) for a, cs in zip(A_list, Cs)])
+    for start in range(0, n_matrices, chunk_size):
+        stop = min(start + chunk_size, n_matrices)
+        A_chunk = A if A.ndim == 2 else A[start:stop]
+        # A diag(p) A^T for the sources block
+        A_sources = A_chunk[..., :n_sources]
+        if diagonal:
+            X_chunk = np.einsum('...ik,...ik,...k->...i', A_sources,
+                                A_sources, powers[start:stop])
+        else:
+            X_chunk = np.matmul(A_sources * powers[start:stop, None, :],
+                                np.swapaxes(A_sources, -1, -2))
+        if n_sources < n_dim:
+            # (A N) (A N)^T for the noise block
+            N = sigma_n * rng.randn(stop - start, n_dim - n_sources,
+                                    n_dim - n_sources)
+            AN = np.matmul(A_chunk[..., n_sources:], N)
+            if diagonal:
+                X_chunk += np.einsum('...ij,...ij->...i', AN, AN)
+            else:
+                X_chunk += np.matmul(AN, np.swapaxes(AN, -1, -2))
+        X[start:stop] = X_chunk
 
     # Generate y
     y = np.log(powers).dot(beta)  # + 50
@@ -0,0 +1,82 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import os
+    import numpy as np
+    import scipy.fft
+    from scipy.signal import get_window
+
+
+def _segments(data, n_fft, n_overlap):
+    # (n_segments, n_channels, n_fft) views on the overlapping segments of a
+    # (n_channels, n_times) recording, as in scipy's `welch`.
+    if data.shape[-1] < n_fft:
+        raise ValueError(f"Recordings of {data.shape[-1]} samples are "
+                         f"shorter than n_fft={n_fft}.")
+    windows = np.lib.stride_tricks.sliding_window_view(data, n_fft, axis=-1)
+    return np.moveaxis(windows[:, ::n_fft - n_overlap], 1, 0)
+
+
+def _band_bins(freqs, frequency_bands):
+    bins = []
+    for band, (fmin, fmax) in frequency_bands.items():
+        in_band = np.flatnonzero((freqs >= fmin) & (freqs < fmax))
+        if len(in_band) == 0:
+            raise ValueError(f"No frequency bin in the {band} band, "
+                             "increase n_fft.")
+        bins.append(slice(in_band[0], in_band[-1] + 1))
+    return bins
+
+
+def welch_covariances(recordings, sfreq, frequency_bands, n_fft=1024,
+                      n_overlap=512, n_jobs=-1):
+    """Covariances of a batch of recordings in several frequency bands.
+
+    The covariance in a band is the real part of the Welch cross-spectral
+    density, with a Hann window, summed over the frequencies of the band,
+    i.e. the covariance of the recording ideally band-pass filtered. The
+    segments of all recordings are transformed in one real FFT run on
+    ``n_jobs`` threads, and every band is read from the same spectrum.
+
+    ``recordings`` is a list of (n_channels, n_times) arrays sampled at
+    ``sfreq``, of any length but with the same channels. Returns an array of
+    shape (n_recordings, n_bands, n_channels, n_channels), with the bands
+    in the order of ``frequency_bands``.
+    """
+    if len({len(data) for data in recordings}) > 1:
+        raise ValueError("The recordings have different numbers of channels.")
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+    segments = [_segments(np.asarray(data, dtype=np.float64), n_fft,
+                          n_overlap) for data in recordings]
+    bounds = np.cumsum([0] + [len(s) for s in segments])
+    segments = np.concatenate(segments)
+    segments -= segments.mean(axis=-1, keepdims=True)
+    window = get_window('hann', n_fft)
+    segments *= window
+
+    freqs = scipy.fft.rfftfreq(n_fft, 1 / sfreq)
+    bins = _band_bins(freqs, frequency_bands)
+    n_bins = max(b.stop for b in bins)
+    spectra = scipy.fft.rfft(segments, axis=-1, workers=n_jobs)[..., :n_bins]
+    del segments
+    # One-sided density times the frequency resolution, so that summing
+    # over a band gives its power. The square root is applied to the
+    # spectra, which are multiplied with themselves.
+    weights = np.full(n_bins, 2.)
+    weights[0] = 1.
+    if n_fft % 2 == 0 and n_bins == len(freqs):
+        weights[-1] = 1.
+    spectra *= np.sqrt(weights / (n_fft * np.sum(window ** 2)))
+
+    n_channels = spectra.shape[1]
+    covs = np.empty((len(recordings), len(bins), n_channels, n_channels))
+    for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        for j, band_bins in enumerate(bins):
+            F = np.moveaxis(spectra[start:stop, :, band_bins], 1, 0)
+            F = F.reshape(n_channels, -1)
+            # Re(F F^H) as one real product, which numpy runs as a
+            # symmetric rank-k update.
+            Z = np.concatenate([F.real, F.imag], axis=1)
+            covs[i, j] = Z @ Z.T / (stop - start)
+    return covs
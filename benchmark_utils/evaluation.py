@@ -0,0 +1,31 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    from sklearn.base import clone
+    from sklearn.metrics import mean_absolute_error, r2_score
+    from benchmark_utils.instrumentation import pipeline_stats
+
+
+# Metrics computed from the predictions on the test set.
+METRICS = dict(score_test=r2_score, mae=mean_absolute_error)
+
+
+def _scores(model, X_train, y_train, X_test, y_test):
+    # Predict each set once: every call to `predict` runs the whole filter
+    # bank transform again.
+    y_pred = model.predict(X_test)
+    scores = {name: metric(y_test, y_pred) for name, metric in METRICS.items()}
+    if len(y_train) > 0:
+        scores['score_train'] = r2_score(y_train, model.predict(X_train))
+    # Time and memory of each step, for solvers run with `instrument=True`.
+    scores.update(pipeline_stats(model))
+    return scores
+
+
+def _evaluate_fold(model, X, y, train, test, n_train, scored, refit):
+    # Runs in a joblib worker, where X is memory-mapped. Workers cannot
+    # import objective.py, which benchopt loads as a dynamic module.
+    if refit:
+        model = clone(model).fit(X[train[:n_train]], y[train[:n_train]])
+    return _scores(model, X[train[scored]], y[train[scored]],
+                   X[test], y[test])
@@ -0,0 +1,218 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import os
+    import json
+    import time
+    import hashlib
+    import argparse
+    import numpy as np
+    import pandas as pd
+    from pathlib import Path
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from benchmark_utils.common import get_X, read_preprocessed
+    from benchmark_utils.cross_spectra import welch_covariances
+    from benchmark_utils.feature_store import write_feature_store
+
+
+FREQUENCY_BANDS = {
+    "low": (0.1, 1),
+    "delta": (1, 4),
+    "theta": (4.0, 8.0),
+    "alpha": (8.0, 15.0),
+    "beta_low": (15.0, 26.0),
+    "beta_mid": (26.0, 35.0),
+    "beta_high": (35.0, 49)
+}
+
+# Preprocessing parameters of `get_X`, which define the cache key together
+# with the frequency bands and the covariance engine.
+PREPROCESSING_PARAMS = dict(notch_freq=60, l_freq=1, h_freq=49, sfreq=200,
+                            tmax=100, n_fft=1024, n_overlap=512,
+                            crop_first=True, chunk_duration=None)
+
+# 'coffeine' band-pass filters each band and estimates its covariance with
+# OAS, subject by subject. 'welch' integrates the Welch cross-spectra of a
+# batch of subjects, computed with multithreaded FFTs, over each band.
+ENGINES = ('coffeine', 'welch')
+
+
+def get_cache_path(cache_dir, task, frequency_bands, engine='coffeine',
+                   **params):
+    # Features computed with different parameters go to different folders,
+    # so changing any parameter recomputes every subject.
+    params = dict(PREPROCESSING_PARAMS, **params)
+    description = dict(params, engine=engine, frequency_bands={
+        band: list(edges) for band, edges in frequency_bands.items()
+    })
+    key = hashlib.sha1(
+        json.dumps(description, sort_keys=True).encode()
+    ).hexdigest()[:12]
+    cache_path = Path(cache_dir) / f'{task}-{key}'
+    cache_path.mkdir(parents=True, exist_ok=True)
+    params_fname = cache_path / 'params.json'
+    if not params_fname.exists():
+        params_fname.write_text(json.dumps(description, indent=2))
+    return cache_path
+
+
+def _save_covs(cache_path, subject_id, covs):
+    # Write then rename, so an interrupted run never leaves a partial file.
+    fname = cache_path / f'{subject_id}.npy'
+    tmp_fname = cache_path / f'{subject_id}.tmp-{os.getpid()}.npy'
+    np.save(tmp_fname, covs)
+    os.replace(tmp_fname, fname)
+    return subject_id
+
+
+def _extract_subject(cache_path, bids_root, datatype, task, subject_id,
+                     frequency_bands, extension, params):
+    covs = get_X(bids_root, datatype, task, subject_id, frequency_bands,
+                 extension, **params)
+    return _save_covs(cache_path, subject_id, covs)
+
+
+def _preprocess_subject(bids_root, datatype, task, subject_id, extension,
+                        params):
+    params = {name: value for name, value in params.items()
+              if name not in ('n_fft', 'n_overlap')}
+    raw = read_preprocessed(bids_root, datatype, task, subject_id, extension,
+                            **params)
+    return raw.get_data(), raw.info['sfreq']
+
+
+def _save_batch(cache_path, batch, frequency_bands, params, n_threads):
+    # Covariances of preprocessed subjects {subject: (data, sfreq)}, which
+    # were resampled to the same frequency.
+    (sfreq,) = {sfreq for _, sfreq in batch.values()}
+    covs = welch_covariances([data for data, _ in batch.values()], sfreq,
+                             frequency_bands, n_fft=params['n_fft'],
+                             n_overlap=params['n_overlap'], n_jobs=n_threads)
+    for sub, sub_covs in zip(batch, covs):
+        _save_covs(cache_path, sub, sub_covs)
+
+
+def extract_features(bids_root, datatype, task, subjects, extension,
+                     cache_dir, frequency_bands=FREQUENCY_BANDS, n_jobs=1,
+                     engine='coffeine', batch_size=16, n_threads=None,
+                     **params):
+    """Run `get_X` over a cohort in a process pool.
+
+    Each subject's covariances are cached as ``{subject}.npy`` in a folder
+    keyed by the preprocessing parameters, and subjects already present in
+    it are skipped. Returns the cache folder and the subjects that failed,
+    mapped to their error.
+
+    With the ``welch`` engine, the pool only preprocesses the subjects, and
+    their covariances are computed ``batch_size`` subjects at a time in this
+    process, with ``n_threads`` FFT threads, by default the cores left by
+    the ``n_jobs`` processes of the pool.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of "
+                         f"{ENGINES}.")
+    if n_threads is None:
+        n_threads = max(1, os.cpu_count() - n_jobs)
+    params = dict(PREPROCESSING_PARAMS, **params)
+    cache_path = get_cache_path(cache_dir, task, frequency_bands,
+                                engine=engine, **params)
+    todo = [sub for sub in subjects
+            if not (cache_path / f'{sub}.npy').exists()]
+    print(f"{len(subjects) - len(todo)} subjects cached in {cache_path}, "
+          f"{len(todo)} to compute.")
+
+    failed, batch = {}, {}
+    n_done = 0
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        if engine == 'coffeine':
+            futures = {
+                pool.submit(_extract_subject, cache_path, Path(bids_root),
+                            datatype, task, sub, frequency_bands, extension,
+                            params): sub
+                for sub in todo
+            }
+        else:
+            futures = {
+                pool.submit(_preprocess_subject, Path(bids_root), datatype,
+                            task, sub, extension, params): sub
+                for sub in todo
+            }
+        for i, future in enumerate(as_completed(futures), start=1):
+            # Drop the future, which holds the preprocessed data.
+            sub = futures.pop(future)
+            # Subjects whose covariances were saved, or which failed.
+            finished = []
+            try:
+                result = future.result()
+            except Exception as e:
+                failed[sub] = repr(e)
+                finished.append(sub)
+            else:
+                if engine == 'welch':
+                    batch[sub] = result
+                else:
+                    finished.append(sub)
+            if batch and (len(batch) == batch_size or i == len(todo)):
+                try:
+                    _save_batch(cache_path, batch, frequency_bands, params,
+                                n_threads)
+                except Exception as e:
+                    failed.update(dict.fromkeys(batch, repr(e)))
+                finished.extend(batch)
+                batch = {}
+            for sub in finished:
+                n_done += 1
+                elapsed = time.perf_counter() - t_start
+                print(f"[{n_done}/{len(todo)}] {sub}: "
+                      f"{'failed' if sub in failed else 'done'} "
+                      f"({60 * n_done / elapsed:.1f} subjects/min)")
+    return cache_path, failed
+
+
+def collect_features(cache_path, participants_fname, store_path,
+                     frequency_bands=FREQUENCY_BANDS):
+    # Gather the cached subjects with a known age into a feature store.
+    df_subjects = pd.read_csv(participants_fname, sep='\t')
+    df_subjects = df_subjects.set_index('participant_id')
+    subjects = [sub for sub in df_subjects.index
+                if (Path(cache_path) / f'{sub}.npy').exists()]
+    ages = df_subjects.loc[subjects]['age'].values
+    covs = (np.load(Path(cache_path) / f'{sub}.npy') for sub in subjects)
+    return write_feature_store(store_path, subjects, covs, ages,
+                               frequency_bands)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compute the filter bank covariances of a BIDS dataset."
+    )
+    parser.add_argument('bids_root', type=Path)
+    parser.add_argument('cache_dir', type=Path)
+    parser.add_argument('--task', default='rest')
+    parser.add_argument('--datatype', default='eeg')
+    parser.add_argument('--extension', default='.vhdr')
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--engine', default='coffeine', choices=ENGINES)
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help="Subjects whose covariances are computed at "
+                             "once by the welch engine.")
+    parser.add_argument('--n-threads', type=int, default=None,
+                        help="FFT threads of the welch engine, by default "
+                             "the cores left by the --n-jobs processes.")
+    parser.add_argument('--store', type=Path, default=None,
+                        help="Write the feature store here once done.")
+    args = parser.parse_args()
+
+    participants_fname = args.bids_root / 'participants.tsv'
+    subjects = pd.read_csv(participants_fname, sep='\t')['participant_id']
+    cache_path, failed = extract_features(
+        args.bids_root, args.datatype, args.task, list(subjects),
+        args.extension, args.cache_dir, n_jobs=args.n_jobs,
+        engine=args.engine, batch_size=args.batch_size,
+        n_threads=args.n_threads
+    )
+    for sub, error in failed.items():
+        print(f"{sub}: {error}")
+    if args.store is not None:
+        collect_features(cache_path, participants_fname, args.store)
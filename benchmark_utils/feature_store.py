@@ -0,0 +1,248 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import os
+    import json
+    import shutil
+    import hashlib
+    import tempfile
+    import weakref
+    import numpy as np
+    import pandas as pd
+    from pathlib import Path
+    import h5io
+    from benchmark_utils.band_tensor import BandTensor, BandDiagonals, pack
+    from benchmark_utils.model_cache import open_cache
+
+
+# A feature store is a directory holding the covariances of all subjects in
+# one .npy buffer of shape (n_subjects, n_bands, n_channels, n_channels),
+# which is memory-mapped when loaded, next to small index files. A packed
+# store holds the upper triangles of the covariances instead, of shape
+# (n_subjects, n_bands, n_channels * (n_channels + 1) / 2), and a diagonal
+# store only their (n_subjects, n_bands, n_channels) variances. Stores built
+# from other files record their size and modification time.
+COVS_FNAME = 'covs.npy'
+VARIANCES_FNAME = 'variances.npy'
+SUBJECTS_FNAME = 'subjects.npy'
+AGES_FNAME = 'ages.npy'
+BANDS_FNAME = 'bands.npy'
+SOURCES_FNAME = 'sources.json'
+
+# Rows of memory-mapped stores copied by `take_rows`, by default in the
+# temporary directory, bounded by the size in GB in the second variable.
+ROWS_CACHE_ENV = 'BENCHMARK_ROWS_CACHE'
+ROWS_CACHE_SIZE_ENV = 'BENCHMARK_ROWS_CACHE_GB'
+
+
+def _source_stats(sources):
+    stats = {}
+    for fname in sources:
+        stat = Path(fname).stat()
+        stats[str(Path(fname).resolve())] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def _is_stale(store_path, sources):
+    # Whether a store is missing or was built from other versions of its
+    # source files. Without its source files, a store is kept as it is.
+    store_path = Path(store_path)
+    if not store_path.exists():
+        return True
+    if not all(Path(fname).exists() for fname in sources):
+        return False
+    try:
+        recorded = json.loads((store_path / SOURCES_FNAME).read_text())
+    except (OSError, ValueError):
+        return True
+    return recorded != _source_stats(sources)
+
+
+def write_feature_store(store_path, subjects, covs, ages, bands,
+                        packed=False, diagonal=False, sources=()):
+    """Write covariances to a feature store, one subject at a time.
+
+    ``covs`` can be any iterable of (n_bands, n_channels, n_channels) arrays
+    aligned with ``subjects``, which are stored packed with ``packed``, or
+    only their diagonals with ``diagonal``. The size and modification time
+    of the ``sources`` files are recorded, so that the store can be rebuilt
+    when they change. The store is written in a temporary directory which
+    is renamed at the end, so that readers never see a partial store.
+    """
+    store_path = Path(store_path)
+    tmp_path = store_path.with_name(f'{store_path.name}.tmp-{os.getpid()}')
+    tmp_path.mkdir(parents=True)
+    try:
+        X = None
+        for i, cov in enumerate(covs):
+            if diagonal:
+                cov = np.diagonal(cov, axis1=-2, axis2=-1)
+            elif packed:
+                cov = pack(cov)
+            if X is None:
+                fname = VARIANCES_FNAME if diagonal else COVS_FNAME
+                X = np.lib.format.open_memmap(
+                    tmp_path / fname, mode='w+', dtype=cov.dtype,
+                    shape=(len(subjects),) + cov.shape
+                )
+            X[i] = cov
+        if X is not None:
+            X.flush()
+            del X
+        np.save(tmp_path / SUBJECTS_FNAME, np.array(subjects, dtype=str))
+        np.save(tmp_path / AGES_FNAME, np.asarray(ages, dtype=float))
+        np.save(tmp_path / BANDS_FNAME, np.array(list(bands), dtype=str))
+        (tmp_path / SOURCES_FNAME).write_text(
+            json.dumps(_source_stats(sources))
+        )
+        try:
+            tmp_path.rename(store_path)
+        except OSError:
+            # Another process wrote the same store concurrently.
+            if not store_path.exists():
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return store_path
+
+
+def convert_hdf5_to_store(h5_fname, participants_fname, store_path, bands):
+    # One-time conversion of a `features_fb_covs_{task}.h5` file, as written
+    # by the feature extraction, with the ages from `participants.tsv`.
+    features = h5io.read_hdf5(h5_fname)
+    subjects = list(features.keys())
+    df_subjects = pd.read_csv(participants_fname, sep='\t')
+    df_subjects = df_subjects.set_index('participant_id')
+    ages = df_subjects.loc[subjects]['age'].values
+    covs = (np.asarray(features[sub]['covs']) for sub in subjects)
+    return write_feature_store(store_path, subjects, covs, ages, bands,
+                               sources=[h5_fname, participants_fname])
+
+
+def load_feature_store(store_path, mmap_mode='r'):
+    """Open a feature store without reading the covariances.
+
+    Returns the covariances as a BandTensor backed by a memory map, packed
+    if the store is, or the BandDiagonals of a diagonal store, the ages and
+    the subject identifiers.
+    """
+    store_path = Path(store_path)
+    subjects = np.load(store_path / SUBJECTS_FNAME)
+    ages = np.load(store_path / AGES_FNAME)
+    bands = np.load(store_path / BANDS_FNAME).tolist()
+    if (store_path / VARIANCES_FNAME).exists():
+        variances = np.load(store_path / VARIANCES_FNAME, mmap_mode=mmap_mode)
+        return BandDiagonals(variances, bands), ages, subjects
+    covs = np.load(store_path / COVS_FNAME, mmap_mode=mmap_mode)
+    return BandTensor(covs, bands), ages, subjects
+
+
+def open_bids_feature_store(bids_root, derivatives_path, task, bands,
+                            dtype=None, packed=False, diagonal=False):
+    # Convert the hdf5 features of a BIDS dataset on first use, then only
+    # memory-map the store. Another `dtype`, the packed layout or the
+    # diagonals are written once in their own store. Stores are rebuilt
+    # when the files they were built from change.
+    store_path = Path(derivatives_path) / f'features_fb_covs_{task}_store'
+    sources = [Path(derivatives_path) / f'features_fb_covs_{task}.h5',
+               Path(bids_root) / 'participants.tsv']
+    if _is_stale(store_path, sources):
+        shutil.rmtree(store_path, ignore_errors=True)
+        convert_hdf5_to_store(*sources, store_path, bands)
+    X, ages, subjects = load_feature_store(store_path)
+    dtype = X.dtype if dtype is None else np.dtype(dtype)
+    if X.dtype == dtype and not packed and not diagonal:
+        return X, ages, subjects
+    layout = '_diagonal' if diagonal else '_packed' if packed else ''
+    variant_path = store_path.with_name(
+        f'{store_path.name}_{dtype.name}{layout}'
+    )
+    variant_sources = [store_path / COVS_FNAME]
+    if _is_stale(variant_path, variant_sources):
+        shutil.rmtree(variant_path, ignore_errors=True)
+        write_feature_store(variant_path, subjects,
+                            (cov.astype(dtype) for cov in X.data), ages,
+                            X.bands, packed=packed, diagonal=diagonal,
+                            sources=variant_sources)
+    return load_feature_store(variant_path)
+
+
+def _memmap_source(data):
+    # File a memory-mapped array reads from and the offset of its first
+    # element in that file, None if it is in memory.
+    mapped = data
+    while isinstance(mapped.base, np.ndarray):
+        mapped = mapped.base
+    if not isinstance(mapped, np.memmap) or mapped.filename is None:
+        return None
+    start = (data.__array_interface__['data'][0] -
+             mapped.__array_interface__['data'][0])
+    return Path(mapped.filename), mapped.offset + start
+
+
+def get_rows_cache():
+    path = os.environ.get(ROWS_CACHE_ENV) or os.path.join(
+        tempfile.gettempdir(), 'benchmark_brain_age_rows'
+    )
+    return open_cache(path, float(os.environ.get(ROWS_CACHE_SIZE_ENV, 10)),
+                      suffix='.npy')
+
+
+def take_rows(X, indices, chunk_size=256):
+    """Rows of a BandTensor, kept memory-mapped if X is.
+
+    Fancy-indexing a memory-mapped BandTensor reads the rows into memory.
+    Instead, the rows are written once, ``chunk_size`` at a time, to a file
+    of the rows cache named after the rows of the source file they are read
+    from, and memory-mapped. Subsets of a store, such as a training set, can
+    then be sliced without reading the others. The file is deleted with the
+    returned rows, and the least recently used ones are evicted once the
+    cache is full. Other BandTensors are indexed in memory.
+    """
+    source = _memmap_source(X.data)
+    if source is None:
+        return X[indices]
+    fname, offset = source
+    indices = np.arange(len(X))[indices]
+    stat = fname.stat()
+    # X may be any view on the file: its rows are located by their offset
+    # and strides in it.
+    digest = hashlib.sha1(indices.tobytes())
+    digest.update(repr((str(fname), offset, X.data.shape, X.data.strides,
+                        X.dtype.str, stat.st_size,
+                        stat.st_mtime_ns)).encode())
+    tmp_fname = None
+    try:
+        cache = get_rows_cache()
+        rows_fname = cache.fname(
+            f'{fname.parent.name}_rows-{digest.hexdigest()[:16]}'
+        )
+        try:
+            rows = np.load(rows_fname, mmap_mode='r')
+            os.utime(rows_fname)
+        except FileNotFoundError:
+            tmp_fname = rows_fname.with_name(
+                f'{rows_fname.name}.tmp-{os.getpid()}'
+            )
+            rows = np.lib.format.open_memmap(
+                tmp_fname, mode='w+', dtype=X.dtype,
+                shape=(len(indices),) + X.data.shape[1:]
+            )
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start:start + chunk_size]
+                rows[start:start + len(chunk)] = X.data[chunk]
+            rows.flush()
+            del rows
+            os.replace(tmp_fname, rows_fname)
+            # Mapped before it can be evicted.
+            rows = np.load(rows_fname, mmap_mode='r')
+            cache.track(rows_fname)
+    except OSError:
+        # E.g. no space left in the cache.
+        if tmp_fname is not None:
+            tmp_fname.unlink(missing_ok=True)
+        return X[indices]
+    weakref.finalize(rows, rows_fname.unlink, True)
+    return type(X)(rows, X.bands)
@@ -0,0 +1,163 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import time
+    import shutil
+    import argparse
+    import tempfile
+    import itertools
+    from pathlib import Path
+    import numpy as np
+    import pandas as pd
+    from joblib import Parallel, delayed
+    from benchmark_utils.band_tensor import BandTensor, _is_shared
+    from benchmark_utils.cli import load_benchmark, get_instance, parse_params
+
+
+# Attributes set by `Objective.set_data`, which the workers restore instead
+# of splitting the data again, as the split copies the training subjects.
+OBJECTIVE_DATA = ('X', 'y', 'X_train', 'y_train', 'X_test', 'y_test',
+                  'n_channels', '_folds', '_scored')
+
+
+def _memmap(X, folder, name):
+    # Copy of X in a .npy file of `folder`, memory-mapped read-only, which
+    # joblib sends to the workers as a file name. Memory-mapped arrays are
+    # kept as they are, and covariances shared by all bands are only
+    # written once.
+    if isinstance(X, BandTensor):
+        if _is_shared(X.data):
+            return type(X).from_shared(_memmap(X.data[:, 0], folder, name),
+                                       X.bands)
+        return type(X)(_memmap(X.data, folder, name), X.bands)
+    if not isinstance(X, np.ndarray) or isinstance(X, np.memmap):
+        return X
+    fname = Path(folder) / f'{name}.npy'
+    np.save(fname, X)
+    return np.load(fname, mmap_mode='r')
+
+
+def solver_grid(solvers, names=None):
+    # (solver name, parameters) of every configuration benchopt would run.
+    configs = []
+    for name, solver in solvers.items():
+        if names is not None and name not in names:
+            continue
+        parameters = getattr(solver, 'parameters', {})
+        for values in itertools.product(*parameters.values()):
+            configs.append((name, dict(zip(parameters, values))))
+    return configs
+
+
+def group_configs(configs):
+    # Configurations fitted in the same worker, one after the other, so
+    # that they share the per-band decompositions cached in the process:
+    # those of a solver with the same method, bands and precision, e.g. its
+    # ranks. Grouping by bands too gives enough groups to keep many workers
+    # busy, at the cost of decomposing a band once per band set that
+    # contains it. Largest groups first.
+    groups = {}
+    for name, params in configs:
+        key = (name, params.get('method'), params.get('frequency_bands'),
+               params.get('dtype'))
+        groups.setdefault(key, []).append((name, params))
+    return sorted(groups.values(), key=len, reverse=True)
+
+
+def _run_group(benchmark_dir, objective_params, data, data_name, configs,
+               max_runs):
+    objective, _, solvers = load_benchmark(benchmark_dir)
+    objective = get_instance(objective, **objective_params)
+    vars(objective).update(data)
+    results = []
+    for name, params in configs:
+        solver = solvers[name].get_instance(**params)
+        skip, _ = solver._set_objective(objective)
+        if skip:
+            continue
+        # Same loop as benchopt's runner, with the solver's stopping
+        # criterion choosing the training sizes.
+        criterion = solver.stopping_criterion.get_runner_instance(
+            max_runs=max_runs, solver=solver
+        )
+        n_iter, curve, stop = criterion.init_stop_val(), [], False
+        while not stop:
+            t_start = time.perf_counter()
+            solver.run(n_iter)
+            elapsed = time.perf_counter() - t_start
+            curve.append(dict(
+                objective_name=str(objective), solver_name=str(solver),
+                data_name=data_name, stop_val=n_iter, time=elapsed,
+                **objective(solver.get_result())
+            ))
+            stop, _, n_iter = criterion.should_stop(n_iter, curve)
+        results.extend(curve)
+    return results
+
+
+def run_grid(benchmark_dir, dataset_name, dataset_params=None,
+             objective_params=None, solver_names=None, n_jobs=1,
+             max_runs=100, temp_folder=None):
+    """Run the solvers' parameter grid on one dataset in parallel workers.
+
+    The dataset is loaded and split once. The data and its split are then
+    memory-mapped from ``temp_folder``, shared memory by default, so that
+    the ``n_jobs`` workers attach to the same pages instead of each loading
+    and splitting their own copy. Each worker runs a group of configurations
+    sharing per-band work, see ``group_configs``. Returns one row per solver
+    run, with benchopt's column names.
+    """
+    objective, datasets, solvers = load_benchmark(benchmark_dir)
+    dataset = get_instance(datasets[dataset_name], **(dataset_params or {}))
+    objective = get_instance(objective, **(objective_params or {}))
+    objective_params = {name: getattr(objective, name)
+                        for name in objective.parameters}
+    objective.set_dataset(dataset)
+
+    if temp_folder is None and Path('/dev/shm').is_dir():
+        temp_folder = '/dev/shm'
+    folder = tempfile.mkdtemp(prefix='grid-', dir=temp_folder)
+    try:
+        data = {name: _memmap(getattr(objective, name), folder, name)
+                for name in OBJECTIVE_DATA}
+        # Lets `set_data` reuse the split if it is called again.
+        data['_split_data'] = data['X']
+        groups = group_configs(solver_grid(solvers, solver_names))
+        results = Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')(
+            delayed(_run_group)(benchmark_dir, objective_params, data,
+                                str(dataset), configs, max_runs)
+            for configs in groups
+        )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return pd.DataFrame([row for group in results for row in group])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run the solvers' parameter grid on one dataset, with "
+                    "the data shared by parallel workers."
+    )
+    parser.add_argument('--dataset', default='Simulated')
+    parser.add_argument('--dataset-param', '-d', nargs='*', default=[],
+                        help="Dataset parameters, as name=value.")
+    parser.add_argument('--objective-param', '-o', nargs='*', default=[],
+                        help="Objective parameters, as name=value.")
+    parser.add_argument('--solvers', nargs='+', default=None)
+    parser.add_argument('--n-jobs', '-j', type=int, default=1)
+    parser.add_argument('--max-runs', type=int, default=100)
+    parser.add_argument('--temp-folder', default=None,
+                        help="Where to memory-map the data, /dev/shm by "
+                             "default.")
+    parser.add_argument('--output', type=Path, default=Path('grid.csv'))
+    args = parser.parse_args()
+
+    t_start = time.perf_counter()
+    df = run_grid(Path(__file__).parent.parent, args.dataset,
+                  parse_params(args.dataset_param),
+                  parse_params(args.objective_param), args.solvers,
+                  n_jobs=args.n_jobs, max_runs=args.max_runs,
+                  temp_folder=args.temp_folder)
+    df.to_csv(args.output, index=False)
+    print(f"{df['solver_name'].nunique()} configurations, {len(df)} runs in "
+          f"{time.perf_counter() - t_start:.1f}s, written to {args.output}")
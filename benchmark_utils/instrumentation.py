@@ -0,0 +1,113 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import time
+    import tracemalloc
+    from contextlib import contextmanager
+    from sklearn.base import BaseEstimator
+    from sklearn.pipeline import Pipeline
+    from sklearn.utils.metaestimators import available_if
+
+
+def _has(method):
+    return lambda self: hasattr(self.estimator, method)
+
+
+@contextmanager
+def _measure(stats, kind, trace_memory):
+    # Add the wall time of the block to `stats[kind + '_time']` and keep the
+    # largest memory allocated on top of what was there before it, as
+    # tracked by tracemalloc, in `stats[kind + '_peak_mem']`.
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if trace_memory:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+    t_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[f'{kind}_time'] = (stats.get(f'{kind}_time', 0) +
+                                 time.perf_counter() - t_start)
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            stats[f'{kind}_peak_mem'] = max(
+                stats.get(f'{kind}_peak_mem', 0), (peak - baseline) / 1e6
+            )
+        if started:
+            tracemalloc.stop()
+
+
+class Instrumented(BaseEstimator):
+    """Record the time and peak memory of the calls to a pipeline step.
+
+    ``stats_`` holds the seconds spent in and the megabytes allocated by the
+    last ``fit``, ``fit_transform`` or ``partial_fit``, and by the calls to
+    ``transform`` and ``predict`` since then. Other attributes are looked up
+    on the wrapped estimator.
+    """
+
+    def __init__(self, estimator, trace_memory=True):
+        self.estimator = estimator
+        self.trace_memory = trace_memory
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper.
+        if name == 'estimator':
+            raise AttributeError(name)
+        return getattr(self.estimator, name)
+
+    def _measure(self, kind):
+        if kind == 'fit':
+            self.stats_ = {}
+        return _measure(self.stats_, kind, self.trace_memory)
+
+    def fit(self, X, y=None, **fit_params):
+        with self._measure('fit'):
+            self.estimator.fit(X, y, **fit_params)
+        return self
+
+    @available_if(_has('partial_fit'))
+    def partial_fit(self, X, y=None, **fit_params):
+        with self._measure('fit'):
+            self.estimator.partial_fit(X, y, **fit_params)
+        return self
+
+    @available_if(_has('transform'))
+    def fit_transform(self, X, y=None, **fit_params):
+        with self._measure('fit'):
+            return self.estimator.fit_transform(X, y, **fit_params)
+
+    @available_if(_has('transform'))
+    def transform(self, X):
+        with self._measure('transform'):
+            return self.estimator.transform(X)
+
+    @available_if(_has('predict'))
+    def predict(self, X):
+        with self._measure('predict'):
+            return self.estimator.predict(X)
+
+    @available_if(_has('score'))
+    def score(self, X, y):
+        return self.estimator.score(X, y)
+
+
+def instrument(model, trace_memory=True):
+    # Wrap each step of a pipeline, or the model as a single step.
+    steps = model.steps if isinstance(model, Pipeline) else [
+        (type(model).__name__.lower(), model)
+    ]
+    return Pipeline([(name, Instrumented(step, trace_memory=trace_memory))
+                     for name, step in steps])
+
+
+def pipeline_stats(model):
+    # Metrics of the instrumented steps of a pipeline, as
+    # {step}_{fit,transform,predict}_{time,peak_mem}.
+    if not isinstance(model, Pipeline):
+        return {}
+    return {f'{name}_{stat}': value
+            for name, step in model.steps if isinstance(step, Instrumented)
+            for stat, value in getattr(step, 'stats_', {}).items()}
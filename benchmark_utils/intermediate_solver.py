@@ -1,15 +1,147 @@
+import math
 from benchopt import BaseSolver
+from benchopt.stopping_criterion import StoppingCriterion
+from benchmark_utils.band_tensor import BandDiagonals
+from benchmark_utils.model_cache import (
+    get_model_cache, make_key, data_hash, code_hash
+)
+
+
+class LearningCurveCriterion(StoppingCriterion):
+    """Stop a learning curve once it is flat or has used its budget.
+
+    The curve stops once the whole training set is fitted, or when the
+    monitored value moved by less than ``eps`` over the last ``patience``
+    steps, all on at least ``min_fraction`` of the training set: on a few
+    subjects, a heavily regularized model predicts a constant and its score
+    is flat too. Once the subjects fitted along the curve add up to
+    ``budget`` times the training set, the curve ends with a fit on the
+    whole training set. The curve is handed over to the solver, whose
+    ``get_next`` spaces the next steps along it.
+    """
+
+    def __init__(self, eps=1e-3, patience=2, budget=4., min_fraction=0.2,
+                 strategy='iteration', key_to_monitor='objective_value'):
+        self.eps = eps
+        self.patience = patience
+        self.budget = budget
+        self.min_fraction = min_fraction
+        super().__init__(eps=eps, patience=patience, budget=budget,
+                         min_fraction=min_fraction, strategy=strategy,
+                         key_to_monitor=key_to_monitor)
+
+    def check_convergence(self, cost_curve):
+        solver = self.solver
+        solver.learning_curve_ = [
+            (solver._n_samples(cost['stop_val']), cost[self.key_to_monitor])
+            for cost in cost_curve
+        ]
+        n_train = len(solver.X)
+        sizes, values = zip(*solver.learning_curve_)
+        if sizes[-1] == n_train:
+            return True, 1
+        last = values[-self.patience - 1:]
+        if (len(last) > self.patience
+                and sizes[-len(last)] >= self.min_fraction * n_train
+                and max(last) - min(last) < self.eps):
+            return True, 1
+        used = sum(sizes) / (self.budget * n_train)
+        # Lets `get_next` jump to the whole training set.
+        solver.budget_spent_ = used >= 1
+        return False, min(used, 1)
 
 
 class IntermediateSolver(BaseSolver):
+    # Whether the solver only uses the variances, and runs on BandDiagonals.
+    diagonal_only = False
+
+    stopping_criterion = LearningCurveCriterion()
+    # The training prefix grows by a factor between `min_growth` and
+    # `max_growth`, chosen so that each step moves the score by about
+    # `resolution` times its range along the curve so far: coarse steps
+    # where the curve is flat and dense ones where it changes.
+    min_growth, max_growth, resolution = 1.2, 4., 0.1
+
+    def skip(self, X, y, n_channels):
+        if isinstance(X, BandDiagonals) and not self.diagonal_only:
+            return True, "the dataset only provides the variances"
+        # Datasets may expose fewer bands than the solver asks for, e.g. the
+        # Simulated dataset with a small `n_bands`.
+        frequency_bands = getattr(self, 'frequency_bands', None)
+        if frequency_bands is not None:
+            missing = [band for band in frequency_bands.split('-')
+                       if band not in X.bands]
+            if missing:
+                return True, f"frequency bands {missing} are not available"
+        return False, None
+
+    def _n_samples(self, n_iter):
+        # Training subjects fitted for a given `n_iter`.
+        return min(n_iter + 10, len(self.X))
+
+    def _growth(self):
+        # Growth factor of the training prefix along `learning_curve_`.
+        (size_a, value_a), (size_b, value_b) = self.learning_curve_[-2:]
+        values = [value for _, value in self.learning_curve_]
+        slope = abs(value_b - value_a) / math.log(size_b / size_a)
+        span = max(values) - min(values)
+        if slope * math.log(self.max_growth) <= self.resolution * span:
+            return self.max_growth
+        return max(math.exp(self.resolution * span / slope), self.min_growth)
+
     def get_next(self, n_iter):
+        if getattr(self, 'budget_spent_', False):
+            return len(self.X)
         if n_iter < 10:
             return 10
-        else:
-            return min(int(n_iter*1.5), len(self.X))
+        # Without the curve up to `n_iter`, e.g. outside of the stopping
+        # criterion, grow by a fixed factor.
+        curve = getattr(self, 'learning_curve_', [])
+        growth = 1.5
+        if (len(curve) >= 2 and curve[-1][0] == self._n_samples(n_iter)
+                and curve[-2][0] < curve[-1][0]):
+            growth = self._growth()
+        return min(max(int(n_iter * growth), n_iter + 1), len(self.X))
 
     def run(self, n_iter):
         # This is the function that is called to evaluate the solver.
         # It runs the algorithm for a given a number of iterations `n_iter`.
-        n_iter = min(n_iter + 10, len(self.X))
-        self.model.fit(self.X[:n_iter], self.y[:n_iter])
+        n_iter = self._n_samples(n_iter)
+        cache = get_model_cache()
+        key = None
+        # Instrumented solvers measure their fit, which a cached model would
+        # replay.
+        if cache is not None and not getattr(self, 'instrument', False):
+            key = make_key(str(self), n_iter, data_hash(self.X, self.y),
+                           code_hash(getattr(self, '_module_filename', None)))
+            model = cache.get(key)
+            if model is not None:
+                # Incremental solvers continue from the loaded model.
+                self.model = model
+                self._incremental_state = (model, n_iter)
+        if key is None or model is None:
+            if getattr(self, 'incremental', False):
+                self._run_incremental(n_iter)
+            else:
+                self.model.fit(self.X[:n_iter], self.y[:n_iter])
+            if key is not None:
+                cache.put(key, self.model)
+        # Lets the objective refit the model on as many subjects, and cache
+        # its metrics along with it.
+        self.model.n_train_samples_ = n_iter
+        self.model.cache_key_ = key
+
+    def _run_incremental(self, n_iter):
+        # Only transform the subjects added since the previous call and
+        # accumulate them in the last step of the pipeline. This requires
+        # the other steps not to depend on the training set.
+        model, n_seen = getattr(self, '_incremental_state', (None, 0))
+        if model is not self.model or n_iter < n_seen:
+            n_seen = 0
+        features, estimator = self.model[:-1], self.model[-1]
+        X_new, y_new = self.X[n_seen:n_iter], self.y[n_seen:n_iter]
+        if n_seen == 0:
+            estimator.fit(features.fit_transform(X_new, y_new), y_new)
+        elif n_iter > n_seen:
+            estimator.partial_fit(features.transform(X_new), y_new)
+        self._incremental_state = (self.model, n_iter)
@@ -0,0 +1,115 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import numpy as np
+    from sklearn.base import BaseEstimator, RegressorMixin, clone
+    from sklearn.decomposition import IncrementalPCA
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.utils.validation import check_is_fitted
+
+
+class MinibatchRegressor(BaseEstimator, RegressorMixin):
+    """Fit a regressor on features computed chunk by chunk.
+
+    ``transformer`` is fitted once, on the first ``projection_size``
+    subjects, and then kept fixed. The subjects are then transformed
+    ``chunk_size`` at a time and accumulated in ``regressor`` with
+    ``partial_fit``, so that only one chunk of covariances and of features
+    is in memory at once. ``partial_fit`` streams more subjects with the
+    same transformer. X is sliced with contiguous ranges of subjects, which
+    only reads these subjects from a memory-mapped BandTensor.
+
+    With more than ``n_components`` features, they are standardized and
+    reduced by a PCA fitted on the same subjects as the transformer, so that
+    the state of the regressor, e.g. the p x p moments of a ridge, does not
+    grow with the number of features. Both are fitted batch by batch, and
+    each batch holds at least ``n_components`` subjects, as an incremental
+    PCA requires. A ridge on the components is a ridge on the standardized
+    features restricted to their span, so the regressor does not
+    standardize them again if it has a ``standardize`` parameter.
+    """
+
+    def __init__(self, transformer, regressor, chunk_size=256,
+                 projection_size=1000, n_components=None):
+        self.transformer = transformer
+        self.regressor = regressor
+        self.chunk_size = chunk_size
+        self.projection_size = projection_size
+        self.n_components = n_components
+
+    def _chunks(self, n_samples):
+        for start in range(0, n_samples, self.chunk_size):
+            yield slice(start, min(start + self.chunk_size, n_samples))
+
+    def fit(self, X, y):
+        n_projection = min(len(X), self.projection_size)
+        self.transformer_ = clone(self.transformer).fit(
+            X[:n_projection], y[:n_projection]
+        )
+        self.regressor_ = clone(self.regressor)
+        self.reducer_ = None
+        self.n_samples_seen_ = 0
+        if self.n_components is not None:
+            self._fit_reducer(X, n_projection)
+        return self.partial_fit(X, y)
+
+    def _fit_reducer(self, X, n_projection):
+        n_components = min(self.n_components, n_projection)
+        batches = _batches(n_projection, max(self.chunk_size, n_components))
+        scaler = StandardScaler()
+        for batch in batches:
+            features = self.transformer_.transform(X[batch])
+            if features.shape[1] <= self.n_components:
+                return
+            scaler.partial_fit(features)
+        pca = IncrementalPCA(n_components=n_components)
+        for batch in batches:
+            pca.partial_fit(scaler.transform(
+                self.transformer_.transform(X[batch])
+            ))
+        self.reducer_ = make_pipeline(scaler, pca)
+        if 'standardize' in self.regressor_.get_params():
+            self.regressor_.set_params(standardize=False)
+
+    def _features(self, X):
+        features = self.transformer_.transform(X)
+        if self.reducer_ is not None:
+            features = self.reducer_.transform(features)
+        return features
+
+    def partial_fit(self, X, y):
+        if not hasattr(self, 'transformer_'):
+            return self.fit(X, y)
+        regressor = self.regressor_
+        for chunk in self._chunks(len(X)):
+            features = self._features(X[chunk])
+            if hasattr(regressor, '_accumulate'):
+                # Solve once, after the last chunk.
+                regressor._accumulate(features, y[chunk])
+            else:
+                regressor.partial_fit(features, y[chunk])
+        if hasattr(regressor, '_solve'):
+            regressor._solve()
+        self.n_samples_seen_ += len(X)
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self)
+        return np.concatenate([self._features(X[chunk])
+                               for chunk in self._chunks(len(X))])
+
+    def predict(self, X):
+        check_is_fitted(self)
+        return np.concatenate([
+            self.regressor_.predict(self._features(X[chunk]))
+            for chunk in self._chunks(len(X))
+        ])
+
+
+def _batches(n_samples, min_size):
+    # Contiguous slices of at least `min_size` samples, or a single slice if
+    # there are fewer samples.
+    bounds = np.linspace(0, n_samples, max(n_samples // min_size, 1) + 1)
+    bounds = bounds.astype(int)
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
@@ -0,0 +1,122 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import os
+    import hashlib
+    from functools import lru_cache
+    from collections import OrderedDict
+    from pathlib import Path
+    import joblib
+    from benchmark_utils.projections import _memoize
+
+
+# Fitted models and their metrics are only cached on disk when this variable
+# points to a directory, as a model loaded from the cache hides its fit
+# time. The cache is bounded by the size in GB in the second variable.
+CACHE_ENV = 'BENCHMARK_MODEL_CACHE'
+CACHE_SIZE_ENV = 'BENCHMARK_MODEL_CACHE_GB'
+
+# Content hashes of the data of this process, by object. Entries are
+# dropped with the data, whose id can then be reused.
+_DATA_HASHES = OrderedDict()
+MAX_DATA_HASHES = 16
+
+
+def data_hash(*arrays):
+    # Content hash of arrays or BandTensors, computed once per object.
+    return _memoize(_DATA_HASHES, MAX_DATA_HASHES,
+                    tuple(id(a) for a in arrays), arrays,
+                    lambda: joblib.hash(arrays))
+
+
+@lru_cache()
+def code_hash(*fnames):
+    # Hash of the benchmark_utils sources and of the given files, so that
+    # changing the code invalidates the cached models.
+    sha1 = hashlib.sha1()
+    fnames = sorted(Path(__file__).parent.glob('*.py')) + [
+        Path(fname) for fname in fnames if fname is not None
+    ]
+    for fname in fnames:
+        sha1.update(fname.read_bytes())
+    return sha1.hexdigest()
+
+
+def make_key(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+class ModelCache:
+    """Directory of pickled objects with least-recently-used eviction.
+
+    Each entry is a file written atomically, whose modification time is
+    updated when it is read. Once the files take more than ``max_bytes``,
+    the least recently used ones are removed. Several processes can share
+    the same directory: each one scans it when the size it has seen so far
+    goes over the bound. Files with another ``suffix`` can be written to
+    ``fname(key)`` by other means and bounded with ``track``.
+    """
+
+    def __init__(self, path, max_bytes, suffix='.pkl'):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._n_bytes = None
+
+    def fname(self, key):
+        return self.path / f'{key}{self.suffix}'
+
+    def get(self, key):
+        fname = self.fname(key)
+        try:
+            value = joblib.load(fname)
+            os.utime(fname)
+        except Exception:
+            # Missing, evicted concurrently or unreadable with this code.
+            return None
+        return value
+
+    def put(self, key, value):
+        fname = self.fname(key)
+        tmp_fname = fname.with_name(f'{fname.name}.tmp-{os.getpid()}')
+        joblib.dump(value, tmp_fname)
+        os.replace(tmp_fname, fname)
+        self.track(fname)
+
+    def track(self, fname):
+        # Count a new entry and evict the least recently used ones if the
+        # cache is over its bound.
+        if self._n_bytes is not None:
+            self._n_bytes += fname.stat().st_size
+        if self._n_bytes is None or self._n_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for fname in self.path.glob(f'*{self.suffix}'):
+            try:
+                stat = fname.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            fname.unlink(missing_ok=True)
+            total -= size
+        self._n_bytes = total
+
+
+def get_model_cache():
+    path = os.environ.get(CACHE_ENV)
+    if not path:
+        return None
+    return open_cache(path, float(os.environ.get(CACHE_SIZE_ENV, 10)))
+
+
+@lru_cache()
+def open_cache(path, max_gb, suffix='.pkl'):
+    # One instance per directory, which keeps track of its size.
+    return ModelCache(path, max_gb * 1e9, suffix=suffix)
@@ -0,0 +1,220 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import hashlib
+    import weakref
+    from collections import OrderedDict
+    import numpy as np
+    from scipy.linalg import eigh, pinv
+    import coffeine
+    from coffeine.spatial_filters import ProjCommonSpace, ProjSPoCSpace
+    from coffeine.covariance_transformers import Riemann, LogDiag
+    from sklearn.compose import make_column_transformer
+    from sklearn.pipeline import make_pipeline
+    from benchmark_utils.band_tensor import unpacked_from, PackedCovariance
+
+
+# Decompositions shared by all the projections fitted on the same training
+# covariances in this process, e.g. the pipeline solver run with each value
+# of `rank`. Entries are dropped once the covariances they were computed on
+# are freed, e.g. the training set of a fold refitted by the objective.
+_DECOMPOSITIONS = OrderedDict()
+MAX_DECOMPOSITIONS = 64
+MAX_DECOMPOSITIONS_BYTES = 1e9
+
+
+def _covs_key(X):
+    # Identify a column of covariances by the memory of its cells, which is
+    # the same for every solver that receives the same training set, and
+    # return the cells, for which the key is only valid while they live.
+    # Covariances unpacked from a packed BandTensor are new arrays on every
+    # call: all the rows of one, in order, are identified by the packed
+    # array instead. Other unpacked covariances have no key. Columns of
+    # PackedCovariances are identified by their packed rows.
+    if isinstance(X, np.ndarray) and X.dtype != object:
+        cells = X
+        pointers = [X.__array_interface__['data'][0], *X.strides]
+        shape, dtype = X.shape, X.dtype
+    else:
+        cells = np.asarray(X, dtype=object).ravel()
+        if isinstance(cells[0], PackedCovariance):
+            packed = np.empty(len(cells), dtype=object)
+            for i, cell in enumerate(cells):
+                packed[i] = cell.packed
+            key, packed = _covs_key(packed)
+            return ('packed', key), packed
+        pointers = [c.__array_interface__['data'][0] for c in cells]
+        shape, dtype = (len(cells),) + cells[0].shape, cells[0].dtype
+    unpacked = unpacked_from(cells if cells.dtype != object else cells[0])
+    if unpacked is not None:
+        C, P = unpacked
+        start = C.__array_interface__['data'][0]
+        if cells.dtype == object:
+            whole = pointers == [start + i * C.strides[0]
+                                 for i in range(len(C))]
+        else:
+            whole = pointers == [start, *C.strides]
+        if shape != C.shape or not whole:
+            return None, cells
+        key, P = _covs_key(P)
+        return ('packed', key), P
+    digest = hashlib.sha1(np.asarray(pointers, dtype=np.int64).tobytes())
+    return (shape, str(dtype), digest.hexdigest()), cells
+
+
+def _owners(obj, owners):
+    # Objects `obj` depends on, by id: the arrays owning the memory of its
+    # arrays, and its other objects, looking into containers.
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            for cell in obj.ravel():
+                _owners(cell, owners)
+            return owners
+        while isinstance(obj.base, np.ndarray):
+            obj = obj.base
+        owners[id(obj)] = obj
+    elif isinstance(obj, (tuple, list)):
+        for item in obj:
+            _owners(item, owners)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            _owners(item, owners)
+    else:
+        owners[id(obj)] = obj
+    return owners
+
+
+def _nbytes(value):
+    return sum(owner.nbytes for owner in _owners(value, {}).values()
+               if isinstance(owner, np.ndarray)
+               and not isinstance(owner, np.memmap))
+
+
+def _memoize(cache, max_size, key, data, compute, max_bytes=None):
+    # LRU lookup in `cache`, whose entries only hold weak references to
+    # `data`, the objects `key` was derived from: an entry whose data was
+    # freed is invalid, as its memory, and key, can be reused by new data.
+    # The cache holds at most `max_size` values, of `max_bytes` in total.
+    for stale in [k for k, (refs, _, _) in cache.items()
+                  if any(ref() is None for ref in refs)]:
+        del cache[stale]
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key][1]
+    value = compute()
+    refs = []
+    for owner in _owners(data, {}).values():
+        try:
+            refs.append(weakref.ref(owner))
+        except TypeError:
+            # Immutable values, such as strings, are safe to forget.
+            pass
+    cache[key] = (refs, value, _nbytes(value))
+    while len(cache) > 1 and (
+            len(cache) > max_size or
+            max_bytes is not None and
+            sum(nbytes for _, _, nbytes in cache.values()) > max_bytes):
+        cache.popitem(last=False)
+    return value
+
+
+def _get_decomposition(kind, X, params, decompose):
+    key, cells = _covs_key(X)
+    if key is None:
+        return decompose()
+    return _memoize(_DECOMPOSITIONS, MAX_DECOMPOSITIONS, (kind, key, params),
+                    cells, decompose, max_bytes=MAX_DECOMPOSITIONS_BYTES)
+
+
+def _stack_covs(X):
+    if isinstance(X, np.ndarray) and X.dtype != object:
+        return X.astype(float)
+    return np.stack(np.asarray(X, dtype=object).ravel()).astype(float)
+
+
+def _sorted_eigvecs(eigvals, eigvecs):
+    return eigvecs[:, np.argsort(np.abs(eigvals))[::-1]]
+
+
+class ProjCommonSpaceSweep(ProjCommonSpace):
+    # Same as coffeine's ProjCommonSpace, but the eigendecomposition of the
+    # mean covariance is shared between all `n_compo` values.
+    def fit(self, X, y=None):
+        def decompose():
+            covs = _stack_covs(X)
+            scale = self.scale
+            if scale == 'auto':
+                scale = 1 / np.mean(np.trace(covs, axis1=1, axis2=2))
+            return scale, _sorted_eigvecs(*eigh(covs.mean(axis=0)))
+
+        self.scale_, eigvecs = _get_decomposition(
+            'common', X, (self.scale,), decompose
+        )
+        if self.n_compo == 'full':
+            self.n_compo = len(eigvecs)
+        filters = eigvecs[:, :self.n_compo].T
+        self.filters_ = [filters]
+        self.patterns_ = [pinv(filters).T]
+        return self
+
+
+class ProjSPoCSpaceSweep(ProjSPoCSpace):
+    # Same as coffeine's ProjSPoCSpace, but the generalized eigendecomposition
+    # is shared between all `n_compo` values.
+    def fit(self, X, y=None):
+        y = np.asarray(y, dtype=float)
+
+        def decompose():
+            covs = _stack_covs(X)
+            scale = self.scale
+            if scale == 'auto':
+                scale = 1 / np.mean(np.trace(covs, axis1=1, axis2=2))
+            target = y.astype(np.float32)
+            target -= target.mean()
+            target /= target.std()
+            C = covs.mean(axis=0)
+            Cz = np.mean(covs * target[:, None, None], axis=0)
+            n_chan = len(C)
+            C = ((1 - self.shrink) * C +
+                 self.shrink * np.trace(C) * np.eye(n_chan) / n_chan)
+            return scale, _sorted_eigvecs(*eigh(Cz, C))
+
+        params = (self.scale, self.shrink,
+                  hashlib.sha1(y.tobytes()).hexdigest())
+        self.scale_, eigvecs = _get_decomposition(
+            'spoc', X, params, decompose
+        )
+        if self.n_compo == 'full':
+            self.n_compo = len(eigvecs)
+        filters = eigvecs[:, :self.n_compo].T
+        filters = filters / np.linalg.norm(filters, axis=1)[:, None]
+        self.filter_ = filters
+        self.pattern_ = pinv(filters).T
+        return self
+
+
+def make_filter_bank_transformer(names, method, projection_params=None,
+                                 rank_sweep=False):
+    # coffeine's filter bank transformer, with the projections of the
+    # `riemann` and `spoc` methods sharing their decompositions across ranks
+    # when `rank_sweep` is set. Defaults follow coffeine.
+    if not rank_sweep or method not in ('riemann', 'spoc'):
+        return coffeine.make_filter_bank_transformer(
+            names=names, method=method, projection_params=projection_params
+        )
+    if method == 'riemann':
+        projection_params_ = dict(scale=1, n_compo='full', reg=1.e-05)
+        projection, vectorization = ProjCommonSpaceSweep, Riemann
+        vectorization_params = dict(metric='riemann')
+    else:
+        projection_params_ = dict(n_compo='full', scale='auto', reg=1.e-05,
+                                  shrink=1)
+        projection, vectorization = ProjSPoCSpaceSweep, LogDiag
+        vectorization_params = dict()
+    projection_params_.update(projection_params or {})
+    return make_column_transformer(
+        *[(make_pipeline(projection(**projection_params_),
+                         vectorization(**vectorization_params)), name)
+          for name in names],
+        remainder='passthrough'
+    )
@@ -0,0 +1,306 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import hashlib
+    from collections import OrderedDict
+    import numpy as np
+    from scipy.linalg import eigh
+    from sklearn.base import BaseEstimator, RegressorMixin
+    from sklearn.pipeline import make_pipeline
+    from sklearn.utils.validation import check_array, check_is_fitted
+    from benchmark_utils.common import IdentityTransformer, FilterBankDiag
+    from benchmark_utils.projections import (
+        make_filter_bank_transformer, _covs_key, _memoize
+    )
+    from benchmark_utils.tangent_space import FilterBankTangentSpace
+
+
+def _ridge_gcv(gram, Xty, y_ss, n_samples, alphas, kernel=False):
+    # Ridge on centered data from its sufficient statistics: the Gram matrix
+    # X^T X, X^T y and y^T y. One eigendecomposition of the Gram matrix gives
+    # the solution and the generalized cross-validation error for every alpha.
+    # With `kernel`, `gram` is the kernel X X^T between samples and `Xty` is
+    # y, which is cheaper with more features than samples: both matrices
+    # have the same non-zero eigenvalues, and the solution returned is the
+    # dual one, a with w = X^T a.
+    eigvals, eigvecs = eigh(gram)
+    eigvals = np.clip(eigvals, 0, None)
+    proj = eigvecs.T @ Xty
+    # Squared projections of X^T y on the eigenvectors of X^T X.
+    proj_ss = proj ** 2 * eigvals if kernel else proj ** 2
+    best = None
+    for alpha in alphas:
+        shrink = 1 / (eigvals + alpha)
+        # The intercept, fitted by centering, uses one degree of freedom.
+        dof = 1 + np.sum(eigvals * shrink)
+        # y^T y - 2 w^T X^T y + w^T X^T X w, with w = V diag(shrink) V^T X^T y
+        rss = y_ss - np.sum(proj_ss * shrink * (2 - eigvals * shrink))
+        denominator = (1 - dof / n_samples) ** 2
+        gcv = (max(rss, 0) / n_samples / denominator
+               if denominator > 1e-12 else np.inf)
+        if best is None or gcv < best[0]:
+            best = (gcv, alpha, eigvecs @ (proj * shrink))
+    return best
+
+
+def _standardization(var, variance_threshold):
+    # Features kept and their scale, from their variances.
+    support = np.ones(len(var), dtype=bool)
+    if variance_threshold is not None:
+        support = var > variance_threshold
+    scale = np.sqrt(var[support])
+    scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.
+    return support, scale
+
+
+class IncrementalRidgeGCV(BaseEstimator, RegressorMixin):
+    """Standardization and ridge regression fitted from running statistics.
+
+    Equivalent to ``make_pipeline(VarianceThreshold(variance_threshold),
+    StandardScaler(), RidgeCV(alphas))``, except that alpha is chosen by
+    generalized cross-validation. ``partial_fit`` only processes the new
+    samples: it merges their mean, co-moment matrix and cross-moment with
+    the target into the running ones, so fitting on a growing prefix costs
+    about one fit on the largest prefix. Without ``standardize``, the ridge
+    is fitted on the features as they are.
+    """
+
+    def __init__(self, alphas=(0.1, 1.0, 10.0), variance_threshold=None,
+                 standardize=True):
+        self.alphas = alphas
+        self.variance_threshold = variance_threshold
+        self.standardize = standardize
+
+    def fit(self, X, y):
+        for attr in ['n_samples_seen_', 'mean_', 'comoment_', 'y_mean_',
+                     'cross_moment_', 'y_moment_']:
+            if hasattr(self, attr):
+                delattr(self, attr)
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        self._accumulate(X, y)
+        return self._solve()
+
+    def _accumulate(self, X, y):
+        # Merge the moments of a batch, without solving.
+        X = check_array(X, dtype=[np.float64, np.float32])
+        # float32 features are centered in float64, so that the moments,
+        # and the eigendecomposition of the Gram matrix, are in float64.
+        y = np.asarray(y, dtype=np.float64)
+        n_new = len(X)
+        mean_new = X.mean(axis=0, dtype=np.float64)
+        y_mean_new = y.mean()
+        Xc, yc = X - mean_new, y - y_mean_new
+        comoment, cross_moment = Xc.T @ Xc, Xc.T @ yc
+        y_moment = yc @ yc
+
+        if not hasattr(self, 'n_samples_seen_'):
+            self.n_samples_seen_ = n_new
+            self.mean_, self.y_mean_ = mean_new, y_mean_new
+            self.comoment_, self.cross_moment_ = comoment, cross_moment
+            self.y_moment_ = y_moment
+        else:
+            # Chan et al. pairwise update of the centered moments.
+            n_old = self.n_samples_seen_
+            n_total = n_old + n_new
+            weight = n_old * n_new / n_total
+            delta = mean_new - self.mean_
+            y_delta = y_mean_new - self.y_mean_
+            self.comoment_ += comoment + weight * np.outer(delta, delta)
+            self.cross_moment_ += cross_moment + weight * delta * y_delta
+            self.y_moment_ += y_moment + weight * y_delta ** 2
+            self.mean_ = self.mean_ + delta * n_new / n_total
+            self.y_mean_ = self.y_mean_ + y_delta * n_new / n_total
+            self.n_samples_seen_ = n_total
+        self.n_features_in_ = X.shape[1]
+
+    def _fit_moments(self, n_samples, mean, comoment, y_mean, cross_moment,
+                     y_moment):
+        # Fit from moments computed elsewhere, see FilterBankRidgeGCV.
+        self.n_samples_seen_ = n_samples
+        self.mean_, self.y_mean_ = mean, y_mean
+        self.comoment_, self.cross_moment_ = comoment, cross_moment
+        self.y_moment_ = y_moment
+        self.n_features_in_ = len(mean)
+        return self._solve()
+
+    def _solve(self):
+        n_samples = self.n_samples_seen_
+        var = np.diag(self.comoment_) / n_samples
+        support, scale = _standardization(var, self.variance_threshold)
+        if not self.standardize:
+            scale = np.ones_like(scale)
+        gram = (self.comoment_[np.ix_(support, support)] /
+                np.outer(scale, scale))
+        Xty = self.cross_moment_[support] / scale
+        gcv, self.alpha_, coef = _ridge_gcv(
+            gram, Xty, self.y_moment_, n_samples, self.alphas
+        )
+        self.best_score_ = -gcv
+        self.support_ = support
+        self.coef_ = np.zeros(len(var), dtype=self.comoment_.dtype)
+        self.coef_[support] = coef / scale
+        self.intercept_ = self.y_mean_ - self.mean_ @ self.coef_
+        return self
+
+    def predict(self, X):
+        check_is_fitted(self)
+        X = check_array(X, dtype=[np.float64, np.float32])
+        return X @ self.coef_ + self.intercept_
+
+
+# Per-band features and moments shared by all the FilterBankRidgeGCV fitted
+# on the same training set in this process, e.g. the solvers run with each
+# `frequency_bands` combination.
+_BAND_MOMENTS = OrderedDict()
+MAX_BAND_MOMENTS = 256
+MAX_BAND_MOMENTS_BYTES = 4e9
+
+
+class FilterBankRidgeGCV(BaseEstimator, RegressorMixin):
+    """Filter bank features, standardization and ridge over band unions.
+
+    Equivalent to ``make_pipeline(IdentityTransformer(frequency_bands),
+    filter_bank_transformer, IncrementalRidgeGCV(alphas,
+    variance_threshold))``. The features of each band and the blocks of
+    their co-moment matrix are cached for the training set, so that every
+    combination of bands is assembled from cached blocks and only costs one
+    eigendecomposition of its Gram matrix. With more features than subjects,
+    the ridge is solved in sample space instead: the kernel between subjects
+    of a combination is the sum of the cached kernels of its bands.
+    """
+
+    def __init__(self, frequency_bands, method, projection_params=None,
+                 rank_sweep=False, engine='coffeine', alphas=(0.1, 1.0, 10.0),
+                 variance_threshold=None, dtype='float64'):
+        self.frequency_bands = frequency_bands
+        self.method = method
+        self.projection_params = projection_params
+        self.rank_sweep = rank_sweep
+        self.engine = engine
+        self.alphas = alphas
+        self.variance_threshold = variance_threshold
+        self.dtype = dtype
+
+    def _band_moments(self, X, y, y_key, band):
+        data_key, data = _covs_key(X.stored(band))
+        key = ('features', data_key, y_key, band, self.method,
+               repr(sorted((self.projection_params or {}).items())),
+               self.rank_sweep, self.engine, self.dtype)
+
+        def compute():
+            if self.engine == 'batched' and self.method == 'riemann':
+                transformer = FilterBankTangentSpace(
+                    [band], n_jobs=-1, dtype=self.dtype,
+                    **(self.projection_params or {})
+                )
+            elif self.method == 'diag':
+                transformer = FilterBankDiag([band])
+            else:
+                transformer = make_pipeline(
+                    IdentityTransformer([band]),
+                    make_filter_bank_transformer(
+                        names=[band], method=self.method,
+                        projection_params=self.projection_params,
+                        rank_sweep=self.rank_sweep
+                    )
+                )
+            features = np.asarray(transformer.fit_transform(X, y),
+                                  dtype=self.dtype)
+            mean = features.mean(axis=0, dtype=np.float64)
+            centered = (features - mean).astype(self.dtype, copy=False)
+            var = np.einsum('ij,ij->j', centered, centered,
+                            dtype=np.float64) / len(y)
+            return dict(key=key, transformer=transformer, mean=mean,
+                        centered=centered, var=var,
+                        cross_moment=centered.T @ (y - y.mean()))
+
+        return _memoize(_BAND_MOMENTS, MAX_BAND_MOMENTS, key, data, compute,
+                        max_bytes=MAX_BAND_MOMENTS_BYTES)
+
+    def _comoment(self, block_a, block_b):
+        key = ('comoment', block_a['key'], block_b['key'])
+        return _memoize(
+            _BAND_MOMENTS, MAX_BAND_MOMENTS, key, (block_a, block_b),
+            # Upcast float32 features, whose products would be summed in
+            # float32 otherwise.
+            lambda: (block_a['centered'].astype(np.float64, copy=False).T @
+                     block_b['centered'].astype(np.float64, copy=False)),
+            max_bytes=MAX_BAND_MOMENTS_BYTES
+        )
+
+    def _kernel(self, block):
+        # Products between subjects of the standardized features of a band.
+        key = ('kernel', block['key'], self.variance_threshold)
+
+        def compute():
+            support, scale = _standardization(block['var'],
+                                              self.variance_threshold)
+            features = block['centered'][:, support] / scale
+            return features @ features.T
+
+        return _memoize(_BAND_MOMENTS, MAX_BAND_MOMENTS, key, (block,),
+                        compute, max_bytes=MAX_BAND_MOMENTS_BYTES)
+
+    def _fit_kernel(self, blocks, y):
+        y_mean = y.mean()
+        yc = y - y_mean
+        gcv, self.alpha_, dual_coef = _ridge_gcv(
+            sum(self._kernel(block) for block in blocks), yc, yc @ yc,
+            len(y), self.alphas, kernel=True
+        )
+        self.best_score_ = -gcv
+        coefs = []
+        for block in blocks:
+            support, scale = _standardization(block['var'],
+                                              self.variance_threshold)
+            coef = np.zeros(len(block['mean']))
+            coef[support] = (block['centered'][:, support].T @ dual_coef /
+                             scale ** 2)
+            coefs.append(coef)
+        self.coef_ = np.concatenate(coefs)
+        self.intercept_ = (y_mean -
+                           np.concatenate([b['mean'] for b in blocks]) @
+                           self.coef_)
+
+    def _fit_moments(self, blocks, y):
+        comoment = np.block([
+            [self._comoment(block_a, block_b) if i <= j else
+             self._comoment(block_b, block_a).T
+             for j, block_b in enumerate(blocks)]
+            for i, block_a in enumerate(blocks)
+        ])
+        y_mean = y.mean()
+        ridge = IncrementalRidgeGCV(
+            alphas=self.alphas, variance_threshold=self.variance_threshold
+        )._fit_moments(
+            len(y), np.concatenate([block['mean'] for block in blocks]),
+            comoment, y_mean,
+            np.concatenate([block['cross_moment'] for block in blocks]),
+            (y - y_mean) @ (y - y_mean)
+        )
+        self.alpha_, self.best_score_ = ridge.alpha_, ridge.best_score_
+        self.coef_, self.intercept_ = ridge.coef_, ridge.intercept_
+
+    def fit(self, X, y):
+        y = np.asarray(y, dtype=float)
+        y_key = hashlib.sha1(y.tobytes()).hexdigest()
+        blocks = [self._band_moments(X, y, y_key, band)
+                  for band in self.frequency_bands]
+        if sum(len(block['mean']) for block in blocks) > len(y):
+            self._fit_kernel(blocks, y)
+        else:
+            self._fit_moments(blocks, y)
+        self.transformers_ = [block['transformer'] for block in blocks]
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self)
+        return np.hstack([
+            np.asarray(transformer.transform(X), dtype=self.dtype)
+            for transformer in self.transformers_
+        ])
+
+    def predict(self, X):
+        return self.transform(X) @ self.coef_ + self.intercept_
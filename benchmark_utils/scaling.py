@@ -0,0 +1,178 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import sys
+    import json
+    import argparse
+    from pathlib import Path
+    import numpy as np
+    from sklearn.metrics import r2_score, mean_absolute_error
+    from benchmark_utils.instrumentation import _measure
+    from benchmark_utils.cli import load_benchmark, get_instance
+
+
+# Solver and parameters running each method.
+METHODS = {
+    'diag': ('diag', dict()),
+    'riemann': ('pipeline', dict(method='riemann')),
+    'log_diag': ('pipeline', dict(method='log_diag')),
+    'spoc': ('pipeline', dict(method='spoc')),
+}
+
+# Each axis is swept with the others at their base value.
+BASE = dict(n_subjects=1000, n_channels=20, n_bands=7)
+SWEEPS = dict(
+    n_subjects=[100, 1000, 10000, 100000],
+    n_channels=[20, 64, 128, 306],
+    n_bands=[1, 3, 7],
+)
+
+# Fields identifying a run, and measures compared with the baselines.
+KEYS = ('method', 'n_subjects', 'n_channels', 'n_bands', 'dtype')
+MEASURES = ('fit_time', 'predict_time', 'fit_peak_mem', 'predict_peak_mem')
+
+
+def grid(sweeps=SWEEPS, base=BASE):
+    configs = []
+    for axis, values in sweeps.items():
+        for value in values:
+            config = dict(base, **{axis: value})
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def run_config(benchmark_dir, method, n_subjects, n_channels, n_bands,
+               dtype='float64', trace_memory=True):
+    """Fit and predict with a method on Simulated data of the given size.
+
+    The data is split by the benchmark's objective, and the model is built
+    by the solver running the method, fitted on the whole training set.
+    """
+    objective, datasets, solvers = load_benchmark(benchmark_dir)
+    dataset = get_instance(datasets['Simulated'], n_samples=n_subjects,
+                           n_channels=n_channels, n_bands=n_bands,
+                           dtype=dtype)
+    objective = get_instance(objective)
+    objective.set_dataset(dataset)
+    X = objective.X_train
+
+    solver_name, parameters = METHODS[method]
+    solver = solvers[solver_name]
+    bands = '-'.join(X.bands)
+    solver = get_instance(solver, frequency_bands=bands, dtype=dtype,
+                          **parameters)
+    skip, reason = solver._set_objective(objective)
+    if skip:
+        raise ValueError(f"{method} skipped: {reason}")
+
+    stats = {}
+    with _measure(stats, 'fit', trace_memory):
+        solver.run(len(X))
+    model = solver.get_result()
+    with _measure(stats, 'predict', trace_memory):
+        y_pred = model.predict(objective.X_test)
+    return dict(
+        method=method, n_subjects=n_subjects, n_channels=n_channels,
+        n_bands=n_bands, dtype=dtype, **stats,
+        fit_throughput=len(X) / stats['fit_time'],
+        predict_throughput=len(y_pred) / stats['predict_time'],
+        score_test=r2_score(objective.y_test, y_pred),
+        mae=mean_absolute_error(objective.y_test, y_pred),
+    )
+
+
+def precision_drift(benchmark_dir, method, **config):
+    # Change of the test MAE when running a method in float32 rather than
+    # float64, on the same data and split.
+    maes = {dtype: run_config(benchmark_dir, method, dtype=dtype,
+                              trace_memory=False, **config)['mae']
+            for dtype in ('float64', 'float32')}
+    return dict(method=method, **config, mae_float64=maes['float64'],
+                mae_float32=maes['float32'],
+                mae_drift=maes['float32'] - maes['float64'])
+
+
+def compare(results, baselines, tolerance=0.2):
+    # Measures more than `tolerance` above their baseline, as
+    # (result, measure, baseline value).
+    baselines = {tuple(r[k] for k in KEYS): r for r in baselines}
+    regressions = []
+    for result in results:
+        baseline = baselines.get(tuple(result[k] for k in KEYS))
+        if baseline is None:
+            continue
+        for measure in MEASURES:
+            if measure not in result or measure not in baseline:
+                continue
+            if result[measure] > (1 + tolerance) * baseline[measure]:
+                regressions.append((result, measure, baseline[measure]))
+    return regressions
+
+
+def _estimated_gb(n_subjects, n_channels, dtype, **kwargs):
+    # The Simulated covariances are shared between bands.
+    return n_subjects * n_channels ** 2 * np.dtype(dtype).itemsize / 1e9
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Measure how the solvers scale with the number of "
+                    "subjects, channels and bands on Simulated data."
+    )
+    parser.add_argument('--methods', nargs='+', default=list(METHODS),
+                        choices=list(METHODS))
+    for axis, values in SWEEPS.items():
+        parser.add_argument(f"--{axis.replace('_', '-')}", type=int,
+                            nargs='+', default=values, dest=axis)
+    parser.add_argument('--dtype', default='float64')
+    parser.add_argument('--max-gb', type=float, default=8.,
+                        help="Skip sizes whose covariances need more memory.")
+    parser.add_argument('--drift', action='store_true',
+                        help="Only report the MAE drift of float32 with "
+                             "respect to float64.")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Do not trace memory, which slows down runs.")
+    parser.add_argument('--output', type=Path, default=None,
+                        help="Write the results to this JSON file.")
+    parser.add_argument('--baseline', type=Path, default=None,
+                        help="Compare the results to this JSON file.")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    benchmark_dir = Path(__file__).parent.parent
+    sweeps = {axis: getattr(args, axis) for axis in SWEEPS}
+    results = []
+    for config in grid(sweeps):
+        if _estimated_gb(dtype=args.dtype, **config) > args.max_gb:
+            print(f"{config}: skipped, above --max-gb")
+            continue
+        for method in args.methods:
+            if args.drift:
+                drift = precision_drift(benchmark_dir, method, **config)
+                print(f"{method} {config}: MAE {drift['mae_float64']:.4f} "
+                      f"in float64, drift {drift['mae_drift']:+.2e} in "
+                      "float32")
+                continue
+            try:
+                result = run_config(benchmark_dir, method, dtype=args.dtype,
+                                    trace_memory=not args.no_memory, **config)
+            except ValueError as e:
+                print(f"{config}: {e}")
+                continue
+            results.append(result)
+            print(f"{method} {config}: "
+                  f"fit {result['fit_throughput']:.1f} subjects/s, "
+                  f"predict {result['predict_throughput']:.1f} subjects/s, "
+                  f"peak {result.get('fit_peak_mem', np.nan):.1f} MB")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.baseline is not None:
+        regressions = compare(results, json.loads(args.baseline.read_text()),
+                              args.tolerance)
+        for result, measure, value in regressions:
+            config = {key: result[key] for key in KEYS}
+            print(f"Regression: {config} {measure} "
+                  f"{result[measure]:.3g} > {value:.3g}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,117 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import time
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    from pathlib import Path
+    import numpy as np
+    import pandas as pd
+    import joblib
+    from benchmark_utils.feature_store import load_feature_store
+    from benchmark_utils.cli import load_benchmark, get_instance, parse_params
+
+
+def fit_model(benchmark_dir, solver_name, store_path, model_fname,
+              **parameters):
+    # Fit a solver's model on all the subjects of a feature store and save
+    # it with joblib, for `score_store`.
+    _, _, solvers = load_benchmark(benchmark_dir)
+    X, ages, _ = load_feature_store(store_path)
+    solver = get_instance(solvers[solver_name], **parameters)
+    skip, reason = solver.skip(X, ages, X.n_channels)
+    if skip:
+        raise ValueError(f"{solver} cannot be fitted on {store_path}: "
+                         f"{reason}")
+    solver.set_objective(X, ages, X.n_channels)
+    solver.run(len(X))
+    joblib.dump(solver.get_result(), model_fname)
+    return model_fname
+
+
+def _read_batch(X, start, stop):
+    # Rows of a memory-mapped store read into memory, so that the next batch
+    # is read while the current one is predicted.
+    batch = X[start:stop]
+    return type(batch)(np.ascontiguousarray(batch.data), batch.bands)
+
+
+def score_store(model, store_path, output, batch_size=1024):
+    """Predict the ages of all the subjects of a feature store.
+
+    ``model`` is a fitted pipeline or the file it was saved to with joblib.
+    The covariances are streamed from the memory-mapped store in batches of
+    ``batch_size`` subjects, each transformed at once, and the predictions
+    are appended to the ``output`` CSV file after every batch, with the
+    stored ages. Returns the number of subjects, the total time, the
+    throughput and the latency of each batch, from reading to writing.
+    """
+    if not hasattr(model, 'predict'):
+        model = joblib.load(model)
+    X, ages, subjects = load_feature_store(store_path)
+    bounds = list(range(0, len(X), batch_size)) + [len(X)]
+    latencies = []
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as reader, \
+            open(output, 'w', newline='') as f:
+        next_batch = reader.submit(_read_batch, X, bounds[0], bounds[1])
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            t_batch = time.perf_counter()
+            batch = next_batch.result()
+            if stop < len(X):
+                next_batch = reader.submit(_read_batch, X, stop,
+                                           bounds[i + 2])
+            pd.DataFrame(dict(
+                subject=subjects[start:stop], age=ages[start:stop],
+                age_pred=model.predict(batch)
+            )).to_csv(f, header=i == 0, index=False)
+            f.flush()
+            latencies.append(time.perf_counter() - t_batch)
+    elapsed = time.perf_counter() - t_start
+    return dict(n_subjects=len(X), time=elapsed,
+                throughput=len(X) / elapsed, latencies=latencies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Fit a solver's model on a feature store, or predict "
+                    "the ages of the subjects of a feature store with a "
+                    "fitted model."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fit_parser = subparsers.add_parser('fit')
+    fit_parser.add_argument('store', type=Path)
+    fit_parser.add_argument('model', type=Path,
+                            help="Where to save the fitted model.")
+    fit_parser.add_argument('--solver', default='diag')
+    fit_parser.add_argument('--param', '-p', nargs='*', default=[],
+                            help="Solver parameters, as name=value.")
+    score_parser = subparsers.add_parser('score')
+    score_parser.add_argument('model', type=Path)
+    score_parser.add_argument('store', type=Path)
+    score_parser.add_argument('--output', type=Path,
+                              default=Path('predictions.csv'))
+    score_parser.add_argument('--batch-size', type=int, default=1024)
+    score_parser.add_argument('--verbose', '-v', action='store_true',
+                              help="Report the latency of every batch.")
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        t_start = time.perf_counter()
+        fit_model(Path(__file__).parent.parent, args.solver, args.store,
+                  args.model, **parse_params(args.param))
+        print(f"Fitted in {time.perf_counter() - t_start:.1f}s, saved to "
+              f"{args.model}")
+    else:
+        stats = score_store(args.model, args.store, args.output,
+                            batch_size=args.batch_size)
+        latencies = np.array(stats['latencies'])
+        if args.verbose:
+            for i, latency in enumerate(latencies):
+                print(f"batch {i}: {1e3 * latency:.1f}ms")
+        print(f"{stats['n_subjects']} subjects in {stats['time']:.1f}s, "
+              f"{stats['throughput']:.1f} subjects/s, written to "
+              f"{args.output}")
+        print(f"Batch latency: median {1e3 * np.median(latencies):.1f}ms, "
+              f"max {1e3 * latencies.max():.1f}ms over {len(latencies)} "
+              "batches")
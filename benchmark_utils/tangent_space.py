@@ -0,0 +1,196 @@
+from benchopt import safe_import_context
+
+with safe_import_context() as import_ctx:
+    import os
+    import warnings
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from sklearn.base import BaseEstimator, TransformerMixin
+    from sklearn.utils.validation import check_is_fitted
+    from benchmark_utils.projections import (
+        _get_decomposition, _sorted_eigvecs
+    )
+
+
+def _eigh_apply(C, func):
+    # Matrix function of a stack of symmetric matrices.
+    eigvals, eigvecs = np.linalg.eigh(C)
+    return (eigvecs * func(eigvals)[..., None, :]) @ np.swapaxes(
+        eigvecs, -1, -2
+    )
+
+
+def _map_chunks(func, n_samples, chunk_size, n_jobs):
+    # Apply `func` to consecutive slices of the subjects in a thread pool.
+    # numpy's linear algebra releases the GIL, so the chunks run in parallel
+    # and only chunk-sized temporaries are alive at the same time.
+    chunks = [slice(start, min(start + chunk_size, n_samples))
+              for start in range(0, n_samples, chunk_size)]
+    if n_jobs is None or n_jobs == 1 or len(chunks) == 1:
+        return [func(chunk) for chunk in chunks]
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(func, chunks))
+
+
+def _upper(C):
+    # Upper triangle with off-diagonal terms weighted by sqrt(2), as
+    # pyriemann's `upper`, so that the Euclidean norm of the vectors is the
+    # Frobenius norm of the matrices.
+    n = C.shape[-1]
+    rows, cols = np.triu_indices(n)
+    coeffs = np.where(rows == cols, 1., np.sqrt(2)).astype(C.dtype)
+    return C[..., rows, cols] * coeffs
+
+
+def riemann_mean(covs, tol=10e-9, maxiter=50, chunk_size=256, n_jobs=1):
+    """Affine-invariant Riemannian mean of a stack of SPD matrices.
+
+    Same gradient descent as pyriemann's ``mean_riemann``, with the
+    logarithms of the whitened matrices computed chunk by chunk with
+    stacked eigendecompositions. The matrices can be float32, the mean is
+    always accumulated in float64.
+    """
+    n_samples, n_channels = len(covs), covs.shape[-1]
+    # The gradient cannot get below the rounding error of the logarithms,
+    # which in float32 is above the default tolerance.
+    tol = max(tol, 10 * n_channels * np.finfo(covs.dtype).eps)
+    C = np.sum(_map_chunks(
+        lambda chunk: covs[chunk].sum(axis=0, dtype=np.float64),
+        n_samples, chunk_size, n_jobs
+    ), axis=0) / n_samples
+
+    nu = 1.0
+    tau = np.finfo(np.float64).max
+    for _ in range(maxiter):
+        C12 = _eigh_apply(C, np.sqrt)
+        Cm12 = _eigh_apply(C, lambda eigvals: 1 / np.sqrt(eigvals))
+        Cm12_ = Cm12.astype(covs.dtype)
+        J = np.sum(_map_chunks(
+            lambda chunk: _eigh_apply(Cm12_ @ covs[chunk] @ Cm12_,
+                                      np.log).sum(axis=0, dtype=np.float64),
+            n_samples, chunk_size, n_jobs
+        ), axis=0) / n_samples
+        C = C12 @ _eigh_apply(nu * J, np.exp) @ C12
+
+        crit = np.linalg.norm(J, ord='fro')
+        h = nu * crit
+        if h < tau:
+            nu = 0.95 * nu
+            tau = h
+        else:
+            nu = 0.5 * nu
+        if crit <= tol or nu <= tol:
+            break
+    else:
+        warnings.warn("Convergence not reached")
+    return C
+
+
+def tangent_space(covs, reference, chunk_size=256, n_jobs=1, out=None):
+    """Upper-triangle vectors of log(C_ref^-1/2 C C_ref^-1/2) for a stack."""
+    n_samples, n_channels = len(covs), covs.shape[-1]
+    if out is None:
+        out = np.empty((n_samples, n_channels * (n_channels + 1) // 2),
+                       dtype=covs.dtype)
+    Cm12 = _eigh_apply(reference, lambda eigvals: 1 / np.sqrt(eigvals))
+    Cm12 = Cm12.astype(covs.dtype)
+
+    def project(chunk):
+        out[chunk] = _upper(_eigh_apply(Cm12 @ covs[chunk] @ Cm12, np.log))
+
+    _map_chunks(project, n_samples, chunk_size, n_jobs)
+    return out
+
+
+class FilterBankTangentSpace(BaseEstimator, TransformerMixin):
+    """Projection to a common subspace and Riemannian tangent space per band.
+
+    Computes the same features as coffeine's filter bank transformer with
+    the ``riemann`` method, i.e. ``ProjCommonSpace`` then
+    ``Riemann(metric='riemann')`` for each band, concatenated band after
+    band. It works on the BandTensor directly, one band at a time, so the
+    projected covariances of a single band are in memory at once, and in
+    ``dtype`` precision. Packed covariances are unpacked chunk by chunk.
+    """
+
+    def __init__(self, frequency_bands, n_compo='full', scale=1, reg=1e-05,
+                 dtype='float64', chunk_size=256, n_jobs=1):
+        self.frequency_bands = frequency_bands
+        self.n_compo = n_compo
+        self.scale = scale
+        self.reg = reg
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+
+    def _project(self, X, band, filters, scale):
+        # Packed covariances are only unpacked one chunk at a time.
+        dtype = np.dtype(self.dtype)
+        filters = filters.astype(dtype)
+        n_compo = len(filters)
+        out = np.empty((len(X), n_compo, n_compo), dtype=dtype)
+        reg = self.reg * np.eye(n_compo, dtype=dtype)
+
+        def project(chunk):
+            covs = np.asarray(X[chunk][band], dtype)
+            out[chunk] = filters @ (scale * covs) @ filters.T + reg
+
+        _map_chunks(project, len(X), self.chunk_size, self.n_jobs)
+        return out
+
+    def _fit(self, X, out=None):
+        self.filters_, self.scales_, self.references_ = [], [], []
+        start = 0
+        for band in self.frequency_bands:
+            # Shared between the `n_compo` values fitted on the same data.
+            def decompose():
+                mean = X.mean(band)
+                scale = self.scale
+                if scale == 'auto':
+                    scale = 1 / np.mean(X.diagonal(band).sum(axis=1))
+                return scale, _sorted_eigvecs(*np.linalg.eigh(mean))
+
+            scale, eigvecs = _get_decomposition(
+                'common', X.stored(band), (self.scale,), decompose
+            )
+            n_compo = len(eigvecs) if self.n_compo == 'full' else self.n_compo
+            filters = eigvecs[:, :n_compo].T
+            projected = self._project(X, band, filters, scale)
+            reference = riemann_mean(projected, chunk_size=self.chunk_size,
+                                     n_jobs=self.n_jobs)
+            self.filters_.append(filters)
+            self.scales_.append(scale)
+            self.references_.append(reference)
+            if out is not None:
+                size = n_compo * (n_compo + 1) // 2
+                tangent_space(projected, reference,
+                              chunk_size=self.chunk_size, n_jobs=self.n_jobs,
+                              out=out[:, start:start + size])
+                start += size
+        return self
+
+    def fit(self, X, y=None):
+        return self._fit(X)
+
+    def fit_transform(self, X, y=None):
+        n_compo = X.n_channels if self.n_compo == 'full' else self.n_compo
+        out = np.empty((len(X), len(self.frequency_bands) * n_compo *
+                        (n_compo + 1) // 2), dtype=np.dtype(self.dtype))
+        self._fit(X, out=out)
+        return out
+
+    def transform(self, X):
+        check_is_fitted(self)
+        sizes = [len(f) * (len(f) + 1) // 2 for f in self.filters_]
+        out = np.empty((len(X), sum(sizes)), dtype=np.dtype(self.dtype))
+        start = 0
+        for band, filters, scale, reference, size in zip(
+                self.frequency_bands, self.filters_, self.scales_,
+                self.references_, sizes):
+            tangent_space(self._project(X, band, filters, scale), reference,
+                          chunk_size=self.chunk_size, n_jobs=self.n_jobs,
+                          out=out[:, start:start + size])
+            start += size
+        return out
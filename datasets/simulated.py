@@ -6,9 +6,9 @@ from benchopt import BaseDataset, safe_import_context
 # - getting requirements info when all dependencies are not installed.
 with safe_import_context() as import_ctx:
     import numpy as np
-    import pandas as pd
     from sklearn.utils import check_random_state
     from benchmark_utils.common import _generate_X_y
+    from benchmark_utils.band_tensor import BandTensor, BandDiagonals, pack
 
 
 # All datasets must be named `Dataset` and inherit from `BaseDataset`
@@ -20,6 +20,16 @@ class Dataset(BaseDataset):
     # List of parameters to generate the datasets. The benchmark will consider
     # the cross product for each key in the dictionary.
     # Any parameters 'param' defined here is available as `self.param`.
+    parameters = {
+        'n_samples': [100],
+        'n_channels': [20],
+        'n_bands': [7],
+        'dtype': ['float64'],
+        # Only keep the upper triangles of the covariances.
+        'packed': [False],
+        # Only generate the variances, which is all the diag solver uses.
+        'diagonal': [False],
+    }
 
     def get_data(self):
         # The return arguments of this function are passed as keyword arguments
@@ -37,22 +47,28 @@ class Dataset(BaseDataset):
             "beta_high": (35.0, 49)
         }
         random_state = 42
-        n_channels = 20
-        n_samples = 100
+        n_channels = self.n_channels
+        n_samples = self.n_samples
+        bands = list(frequency_bands_init)[:self.n_bands]
         sigma_n = 0
         sigma_y = 0
 
         rng = check_random_state(random_state)
         A = rng.randn(n_channels, n_channels)
-        A_list = [A for _ in range(n_samples)]
         beta = rng.randn(n_channels)
         powers = rng.uniform(low=0.01, high=1, size=(n_samples, n_channels))
 
-        X, y = _generate_X_y(n_channels, A_list, powers,
-                             beta, sigma_n, sigma_y, rng)
-        X_df = pd.DataFrame(
-            {band: list(X) for band in frequency_bands_init})
+        X, y = _generate_X_y(n_channels, A, powers,
+                             beta, sigma_n, sigma_y, rng,
+                             dtype=np.dtype(self.dtype),
+                             diagonal=self.diagonal)
+        if self.diagonal:
+            X = BandDiagonals.from_shared(X, bands)
+        elif self.packed:
+            X = BandTensor.from_shared(pack(X), bands)
+        else:
+            X = BandTensor.from_shared(X, bands)
         y = np.array(y)
 
         # The dictionary defines the keyword arguments for `Objective.set_data`
-        return dict(X=X_df, y=y, n_channels=n_channels)
+        return dict(X=X, y=y, n_channels=n_channels)
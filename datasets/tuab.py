@@ -5,10 +5,8 @@ from benchopt import BaseDataset, safe_import_context
 # - skipping import to speed up autocompletion in CLI.
 # - getting requirements info when all dependencies are not installed.
 with safe_import_context() as import_ctx:
-    import numpy as np
-    import pandas as pd
     from pathlib import Path
-    import h5io
+    from benchmark_utils.feature_store import open_bids_feature_store
 
 
 # All datasets must be named `Dataset` and inherit from `BaseDataset`
@@ -17,6 +15,16 @@ class Dataset(BaseDataset):
     # Name to select the dataset in the CLI and to display the results.
     name = "tuab"
 
+    # 'float32' halves the memory and bandwidth used by the covariances,
+    # and so does nearly `packed`, which only stores their upper triangles.
+    # `diagonal` only loads their variances, which is all the diag solver
+    # uses.
+    parameters = {
+        'dtype': ['float64'],
+        'packed': [False],
+        'diagonal': [False],
+    }
+
     def get_data(self):
         # The return arguments of this function are passed as keyword arguments
         # to `Objective.set_data`. This defines the benchmark's
@@ -32,27 +40,18 @@ class Dataset(BaseDataset):
         }
 
         task = 'rest'
-        # Read subjects info
         bids_root = Path(
             '/storage/store2/data/TUAB-healthy-bids-bv'
         )
         derivatives_path = Path(
             '/storage/store3/derivatives/TUAB-healthy-bids3'
         )
-        df_subjects = pd.read_csv(
-            bids_root / 'participants.tsv', sep='\t'
-        )
-        df_subjects = df_subjects.set_index('participant_id')
-        features = h5io.read_hdf5(
-            derivatives_path / f'features_fb_covs_{task}.h5'
+        # The covariances are memory-mapped from a feature store, which is
+        # converted from the hdf5 features the first time it is needed.
+        X, y, _ = open_bids_feature_store(
+            bids_root, derivatives_path, task, frequency_bands_init,
+            dtype=self.dtype, packed=self.packed, diagonal=self.diagonal
         )
-        subjects = list(features.keys())
-        covs = [features[sub]['covs'] for sub in subjects]
-        X = np.array(covs)
-        n_channels = X.shape[2]
-        X_df = pd.DataFrame(
-            {band: list(X[:, i]) for i, band in
-                enumerate(frequency_bands_init)})
-        y = df_subjects.loc[subjects]['age'].values
+        n_channels = X.n_channels
         # The dictionary defines the keyword arguments for `Objective.set_data`
-        return dict(X=X_df, y=y, n_channels=n_channels)
+        return dict(X=X, y=y, n_channels=n_channels)
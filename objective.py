@@ -4,9 +4,17 @@ from benchopt import BaseObjective, safe_import_context
 # - skipping import to speed up autocompletion in CLI.
 # - getting requirements info when all dependencies are not installed.
 with safe_import_context() as import_ctx:
+    import site
+    from pathlib import Path
+    import numpy as np
+    from joblib import Parallel, delayed, parallel_config
     from sklearn.dummy import DummyRegressor
-    from sklearn.model_selection import train_test_split
-    from sklearn.metrics import mean_absolute_error
+    from sklearn.model_selection import train_test_split, RepeatedKFold
+    from benchmark_utils.evaluation import _scores, _evaluate_fold
+    from benchmark_utils.feature_store import take_rows
+    from benchmark_utils.model_cache import (
+        get_model_cache, make_key, data_hash, code_hash
+    )
 
 
 # The benchmark objective must be named `Objective` and
@@ -22,6 +30,20 @@ class Objective(BaseObjective):
     # the cross product for each key in the dictionary.
     # All parameters 'p' defined here are available as 'self.p'.
     # This means the OLS objective will have a parameter `self.whiten_y`.
+    parameters = {
+        # 'split' evaluates on one train/test split. 'repeated_kfold' also
+        # refits the solver's model on the other folds of a repeated K-fold
+        # and reports the mean and standard deviation of the metrics.
+        'cv': ['split'],
+        'n_splits': [5],
+        'n_repeats': [2],
+        'random_state': [42],
+        # Folds evaluated in parallel, on a memory-mapped copy of X.
+        'n_jobs': [1],
+        # Fraction of the training set, drawn at random, on which
+        # `score_train` is computed. 0 skips it.
+        'train_scoring': [1.],
+    }
 
     # Minimal version of benchopt required to run this benchmark.
     # Bump it up if the benchmark depends on a new feature of benchopt.
@@ -31,25 +53,93 @@ class Objective(BaseObjective):
         # The keyword arguments of this function are the keys of the dictionary
         # returned by `Dataset.get_data`. This defines the benchmark's
         # API to pass data. This is customizable for each benchmark.
-        X_train, X_test, y_train, y_test = train_test_split(X, y)
-        self.X_train, self.y_train = X_train, y_train
-        self.X_test, self.y_test = X_test, y_test
+        # benchopt calls `set_data` with the same data for every solver.
+        # Reusing the split evaluates them all on the same training set,
+        # which also lets them share per-band work computed on it.
+        if getattr(self, '_split_data', None) is not X:
+            self._folds = self._split(len(y))
+            self._split_data = X
+            self._scored = slice(None)
+            if self.train_scoring < 1:
+                # The folds have at least this many training subjects.
+                n_train = min(len(train) for train, _ in self._folds)
+                rng = np.random.RandomState(self.random_state)
+                self._scored = np.sort(rng.choice(
+                    n_train, int(round(self.train_scoring * n_train)),
+                    replace=False
+                ))
+            # Solvers are fitted on the training set of the first fold, kept
+            # memory-mapped for datasets read from a feature store. The same
+            # arrays are passed to every solver, for the caches keyed on
+            # their memory.
+            train, test = self._folds[0]
+            self._train = take_rows(X, train), y[train]
+            self._test = take_rows(X, test), y[test]
+        self.X, self.y = X, y
+        self.X_train, self.y_train = self._train
+        self.X_test, self.y_test = self._test
         self.n_channels = n_channels
 
+    def _split(self, n_samples):
+        indices = np.arange(n_samples)
+        if self.cv == 'split':
+            return [train_test_split(indices,
+                                     random_state=self.random_state)]
+        rng = np.random.RandomState(self.random_state)
+        cv = RepeatedKFold(n_splits=self.n_splits, n_repeats=self.n_repeats,
+                           random_state=self.random_state)
+        # Shuffle the training indices, which KFold returns sorted, so that
+        # the learning curve prefixes are random subsets of each fold.
+        return [(rng.permutation(train), test)
+                for train, test in cv.split(indices)]
+
     def compute(self, model):
         # The arguments of this function are the outputs of the
         # `Solver.get_result`. This defines the benchmark's API to pass
         # solvers' result. This is customizable for each benchmark.
-        score_train = model.score(self.X_train, self.y_train)
-        score_test = model.score(self.X_test, self.y_test)
-        mae = mean_absolute_error(self.y_test, model.predict(self.X_test))
-        # This method can return many metrics in a dictionary. One of these
-        # metrics needs to be `value` for convergence detection purposes.
-        return dict(score_test=score_test,
-                    value=-score_test,
-                    score_train=score_train,
-                    mae=mae
-                    )
+        # Models from the solvers' cache have their metrics cached too, for
+        # the same objective parameters, code and data.
+        cache = get_model_cache()
+        key = getattr(model, 'cache_key_', None)
+        if cache is None or key is None:
+            return self._compute(model)
+        key = make_key(key, str(self), data_hash(self.X, self.y),
+                       code_hash(getattr(self, '_module_filename', None)))
+        results = cache.get(key)
+        if results is None:
+            results = self._compute(model)
+            cache.put(key, results)
+        return results
+
+    def _compute(self, model):
+        if self.cv == 'split':
+            scores = _scores(model, self.X_train[self._scored],
+                             self.y_train[self._scored],
+                             self.X_test, self.y_test)
+            # This method can return many metrics in a dictionary. One of
+            # these metrics needs to be `value` for convergence detection
+            # purposes.
+            return dict(scores, value=-scores['score_test'])
+
+        # Refit on the same number of subjects as the solver's model, which
+        # is evaluated as is on the first fold.
+        n_train = getattr(model, 'n_train_samples_', len(self.y_train))
+        # benchopt loads benchmark_utils from its file: the workers put the
+        # benchmark on their path to import `_evaluate_fold` back.
+        with parallel_config(backend='loky', initializer=site.addsitedir,
+                             initargs=(str(Path(__file__).parent),)):
+            folds = Parallel(n_jobs=self.n_jobs, max_nbytes='1M',
+                             mmap_mode='r')(
+                delayed(_evaluate_fold)(model, self.X, self.y, train, test,
+                                        n_train, self._scored, refit=i > 0)
+                for i, (train, test) in enumerate(self._folds)
+            )
+        results = {}
+        for name in folds[0]:
+            values = [fold[name] for fold in folds]
+            results[name] = np.mean(values)
+            results[f'{name}_std'] = np.std(values)
+        return dict(results, value=-results['score_test'])
 
     def get_one_solution(self):
         # Return one solution. The return value should be an object compatible
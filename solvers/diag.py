@@ -6,11 +6,12 @@ from benchmark_utils.intermediate_solver import IntermediateSolver
 # - getting requirements info when all dependencies are not installed.
 with safe_import_context() as import_ctx:
     import numpy as np
-    import coffeine
     from sklearn.pipeline import make_pipeline
     from sklearn.preprocessing import StandardScaler
     from sklearn.linear_model import RidgeCV
-    from benchmark_utils.common import IdentityTransformer
+    from benchmark_utils.common import FilterBankDiag, AsType
+    from benchmark_utils.ridge import IncrementalRidgeGCV, FilterBankRidgeGCV
+    from benchmark_utils.instrumentation import instrument
 
 
 # The benchmark solvers must be named `Solver` and
@@ -21,27 +22,46 @@ class Solver(IntermediateSolver):
     name = 'diag'
     install_cmd = 'conda'
     requirements = ['scikit-learn', 'pip:coffeine']
-    parameters = {'frequency_bands': [
+    diagonal_only = True
+    parameters = {"estimator": ["ridge"],
+                  'frequency_bands': [
                       'low', 'delta', 'theta', 'alpha',
                       'beta_low', 'beta_mid',
                       'beta_high', 'alpha-theta',
-                      'low-delta-theta-alpha-beta_low-beta_mid-beta_high']
+                      'low-delta-theta-alpha-beta_low-beta_mid-beta_high'],
+                  # Report the time and memory of each pipeline step.
+                  'instrument': [False],
+                  # Precision of the features and the regression.
+                  'dtype': ['float64'],
                   }
 
     def set_objective(self, X, y, n_channels):
         # Pipeline parameters
         self.X, self.y = X, y
         frequency_bands = self.frequency_bands.split('-')
-        filter_bank_transformer = coffeine.make_filter_bank_transformer(
-            names=frequency_bands,
-            method='diag',
-        )
-        self.model = make_pipeline(
-            IdentityTransformer(frequency_bands),
-            filter_bank_transformer,
-            StandardScaler(),
-            RidgeCV(alphas=np.logspace(-5, 10, 100))
-        )
+        alphas = np.logspace(-5, 10, 100)
+        self.incremental = self.estimator == 'incremental_ridge'
+        if self.estimator == 'gram_ridge':
+            # Features and Gram blocks of each band are shared by all the
+            # `frequency_bands` combinations fitted on the same subjects.
+            self.model = FilterBankRidgeGCV(frequency_bands, method='diag',
+                                            alphas=alphas, dtype=self.dtype)
+        else:
+            # The diag features do not depend on the training set, so the
+            # learning curve can be fitted incrementally.
+            if self.incremental:
+                estimator = [IncrementalRidgeGCV(alphas=alphas)]
+            else:
+                estimator = [StandardScaler(), RidgeCV(alphas=alphas)]
+            self.model = make_pipeline(
+                # Read the variances straight from the covariances, which
+                # can be packed.
+                FilterBankDiag(frequency_bands),
+                AsType(self.dtype),
+                *estimator
+            )
+        if self.instrument:
+            self.model = instrument(self.model)
 
     def get_result(self):
         # Return the result from one optimization run.
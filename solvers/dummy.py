@@ -16,6 +16,7 @@ class Solver(IntermediateSolver):
     name = 'dummy'
     install_cmd = 'conda'
     requirements = ['scikit-learn']
+    diagonal_only = True
 
     def set_objective(self, X, y, n_channels):
 
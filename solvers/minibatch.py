@@ -0,0 +1,94 @@
+from benchopt import safe_import_context
+from benchmark_utils.intermediate_solver import IntermediateSolver
+
+# Protect the import with `safe_import_context()`. This allows:
+# - skipping import to speed up autocompletion in CLI.
+# - getting requirements info when all dependencies are not installed.
+with safe_import_context() as import_ctx:
+    import numpy as np
+    from sklearn.pipeline import make_pipeline
+    from benchmark_utils.common import IdentityTransformer, AsType
+    from benchmark_utils.projections import make_filter_bank_transformer
+    from benchmark_utils.ridge import IncrementalRidgeGCV
+    from benchmark_utils.tangent_space import FilterBankTangentSpace
+    from benchmark_utils.minibatch import MinibatchRegressor
+
+
+# The benchmark solvers must be named `Solver` and
+# inherit from `BaseSolver` for `benchopt` to work properly.
+class Solver(IntermediateSolver):
+
+    # Name to select the solver in the CLI and to display the results.
+    name = 'minibatch'
+    install_cmd = 'conda'
+    requirements = ['scikit-learn', 'coffeine']
+    parameters = {'rank': [0.99],
+                  "method": ["riemann", "log_diag", "spoc"],
+                  'frequency_bands': [
+                      'low-delta-theta-alpha-beta_low-beta_mid-beta_high'],
+                  # Subjects transformed at once.
+                  'chunk_size': [256],
+                  # Subjects the projections are fitted on.
+                  'projection_size': [1000],
+                  # Principal components of the features the regression is
+                  # fitted on, when there are more features. None keeps
+                  # them all.
+                  'n_components': [512],
+                  # Precision of the features and the regression.
+                  'dtype': ['float64'],
+                  }
+
+    def set_objective(self, X, y, n_channels):
+        # Pipeline parameters
+        frequency_bands = self.frequency_bands.split('-')
+        rank = int(self.rank * n_channels)
+        projection_params = dict()
+        if self.method in ['riemann', 'spoc']:
+            projection_params = dict(scale=1, n_compo=rank, reg=0)
+
+        self.X, self.y = X, y
+
+        if self.method == 'riemann':
+            transformer = FilterBankTangentSpace(
+                frequency_bands, n_jobs=-1, dtype=self.dtype,
+                **projection_params
+            )
+        else:
+            transformer = make_pipeline(
+                IdentityTransformer(frequency_bands),
+                make_filter_bank_transformer(
+                    names=frequency_bands,
+                    method=self.method,
+                    projection_params=projection_params
+                ),
+                AsType(self.dtype)
+            )
+        alphas = np.logspace(-5, 10, 100)
+        self.incremental = True
+        self.model = MinibatchRegressor(
+            transformer,
+            IncrementalRidgeGCV(alphas=alphas, variance_threshold=1e-10),
+            chunk_size=self.chunk_size,
+            projection_size=self.projection_size,
+            n_components=self.n_components
+        )
+
+    def _run_incremental(self, n_iter):
+        # Refit while the projections are fitted on fewer subjects than
+        # `projection_size`, then only stream the new subjects.
+        model, n_seen = getattr(self, '_incremental_state', (None, 0))
+        if model is not self.model:
+            n_seen = 0
+        if n_iter < n_seen or n_seen < self.projection_size:
+            self.model.fit(self.X[:n_iter], self.y[:n_iter])
+        elif n_iter > n_seen:
+            self.model.partial_fit(self.X[n_seen:n_iter],
+                                   self.y[n_seen:n_iter])
+        self._incremental_state = (self.model, n_iter)
+
+    def get_result(self):
+        # Return the result from one optimization run.
+        # The outputs of this function are the arguments of `Objective.compute`
+        # This defines the benchmark's API for solvers' results.
+        # it is customizable for each benchmark.
+        return self.model
@@ -6,12 +6,15 @@ from benchmark_utils.intermediate_solver import IntermediateSolver
 # - getting requirements info when all dependencies are not installed.
 with safe_import_context() as import_ctx:
     import numpy as np
-    import coffeine
     from sklearn.pipeline import make_pipeline
     from sklearn.preprocessing import StandardScaler
     from sklearn.linear_model import RidgeCV
     from sklearn.feature_selection import VarianceThreshold
-    from benchmark_utils.common import IdentityTransformer
+    from benchmark_utils.common import IdentityTransformer, AsType
+    from benchmark_utils.projections import make_filter_bank_transformer
+    from benchmark_utils.ridge import IncrementalRidgeGCV, FilterBankRidgeGCV
+    from benchmark_utils.tangent_space import FilterBankTangentSpace
+    from benchmark_utils.instrumentation import instrument
 
 
 # The benchmark solvers must be named `Solver` and
@@ -29,9 +32,26 @@ class Solver(IntermediateSolver):
                       'low', 'delta', 'theta', 'alpha',
                       'beta_low', 'beta_mid',
                       'beta_high', 'alpha-theta',
-                      'low-delta-theta-alpha-beta_low-beta_mid-beta_high']
+                      'low-delta-theta-alpha-beta_low-beta_mid-beta_high'],
+                  # Share the per-band decompositions across `rank` values.
+                  'rank_sweep': [True],
+                  # 'batched' computes the riemann features of all subjects
+                  # with stacked eigendecompositions on all cores.
+                  'engine': ['coffeine'],
+                  # Report the time and memory of each pipeline step.
+                  'instrument': [False],
+                  # Precision of the features and the regression.
+                  'dtype': ['float64'],
                   }
 
+    def skip(self, X, y, n_channels):
+        if self.estimator == 'incremental_ridge' and self.method != 'log_diag':
+            return True, (f"{self.method} projections depend on the training "
+                          "set and cannot be fitted incrementally")
+        if self.engine == 'batched' and self.method != 'riemann':
+            return True, "the batched engine only implements riemann"
+        return super().skip(X, y, n_channels)
+
     def set_objective(self, X, y, n_channels):
         # Pipeline parameters
         frequency_bands = self.frequency_bands.split('-')
@@ -43,20 +63,44 @@ class Solver(IntermediateSolver):
             projection_params = dict(scale=scale, n_compo=rank, reg=reg)
 
         self.X, self.y = X, y
+        alphas = np.logspace(-5, 10, 100)
+        self.incremental = self.estimator == 'incremental_ridge'
+        if self.estimator == 'gram_ridge':
+            # Features and Gram blocks of each band are shared by all the
+            # `frequency_bands` combinations fitted on the same subjects.
+            self.model = FilterBankRidgeGCV(
+                frequency_bands, method=self.method,
+                projection_params=projection_params,
+                rank_sweep=self.rank_sweep, engine=self.engine,
+                alphas=alphas, variance_threshold=1e-10, dtype=self.dtype
+            )
+        else:
+            if self.engine == 'batched':
+                features = [FilterBankTangentSpace(
+                    frequency_bands, n_jobs=-1, dtype=self.dtype,
+                    **projection_params
+                )]
+            else:
+                features = [
+                    IdentityTransformer(frequency_bands),
+                    make_filter_bank_transformer(
+                        names=frequency_bands,
+                        method=self.method,
+                        projection_params=projection_params,
+                        rank_sweep=self.rank_sweep
+                    ),
+                    AsType(self.dtype)
+                ]
 
-        filter_bank_transformer = coffeine.make_filter_bank_transformer(
-            names=frequency_bands,
-            method=self.method,
-            projection_params=projection_params
-        )
-
-        self.model = make_pipeline(
-            IdentityTransformer(frequency_bands),
-            filter_bank_transformer,
-            VarianceThreshold(1e-10),
-            StandardScaler(),
-            RidgeCV(alphas=np.logspace(-5, 10, 100))
-        )
+            if self.incremental:
+                estimator = [IncrementalRidgeGCV(alphas=alphas,
+                                                 variance_threshold=1e-10)]
+            else:
+                estimator = [VarianceThreshold(1e-10), StandardScaler(),
+                             RidgeCV(alphas=alphas)]
+            self.model = make_pipeline(*features, *estimator)
+        if self.instrument:
+            self.model = instrument(self.model)
 
     def get_result(self):
         # Return the result from one optimization run.